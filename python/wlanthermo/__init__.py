@@ -10,6 +10,9 @@ from wlanthermo.settings import *
 from wlanthermo.sensors import *
 from wlanthermo.website import *
 from wlanthermo.modules import Modules
+from wlanthermo.history import History
+from wlanthermo.mqtt import MqttIngest
+from wlanthermo.database import migrate_database
 from multiprocessing import Process, Queue
 from wlanthermo.modules.fake import *
 
@@ -55,6 +58,7 @@ class Wlanthermo:
         self.set_database_uri()
         self.db = SQLAlchemy(self.app)
         Base.metadata.create_all(self.db.engine)
+        migrate_database(self.db.engine)
 
         self.channels = None
 
@@ -142,18 +146,32 @@ class Wlanthermo:
         self.channels = Channels(self)
         self.channels.register_api()
 
+        self.history = History(self)
+        self.history.register_api()
+
         self.sensors = Sensors(self)
         # self.sensors.register_api()
 
         self.modules = Modules(self)
         self.modules.register_api()
 
+        self.mqtt = MqttIngest(self)
+
         self.website = Website(self)
         self.website.register_url()
 
     def run(self):
+        self.channels.start()
+        self.history.start()
+        self.sensors.start()
+        self.mqtt.start()
         self.fake_module.start()
-        self.app.run()
+        # Threaded, channel streams keep their connection open
+        self.app.run(threaded=True)
+        self.mqtt.stop()
+        self.sensors.stop()
+        self.history.stop()
+        self.channels.stop()
 
     def stop(self, sender, **kwarg):
         self.runapp = False
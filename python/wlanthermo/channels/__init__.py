@@ -4,6 +4,9 @@
 from collections import namedtuple
 from wlanthermo.database.tables import *
 from wlanthermo.settings import *
+from .state import *
+from .stream import *
+from .colors import *
 import json
 import time
 import logging
@@ -12,26 +15,33 @@ import webcolors
 from enum import IntEnum
 from threading import Thread
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Enum, Float, Boolean
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Enum, Float, Boolean, tuple_
 from sqlalchemy.orm import relationship
-from flask import jsonify, request, abort
+from flask import jsonify, request, abort, Response
 
 __author__ = 'Björn Schrader <wlanthermo@bjoern-schrader.de>'
 __license__ = 'GNU General Public License http://www.gnu.org/licenses/gpl.html'
 __copyright__ = 'Copyright (C) 2017 by WLANThermo Project - Released under terms of the GPLv3 License'
 
-PreferredColorList = ['Blue', 'Chartreuse', 'Aquamarine', 'Yellow', 'HotPink', 'Red', 'Purple', 'Green', 'Orange',
-                      'Black', 'White', 'Brown', 'Plum', 'SkyBlue', 'OrangeRed', 'Salmon', 'DarkGrey', 'Violet',
-                      'Turquoise', 'Khaki', 'DarkViolet', 'SeaGreen', 'SteelBlue', 'Gold', 'DarkGreen', 'MidnightBlue',
-                      'DarkKhaki', 'DarkOliveGreen', 'Pink', 'Grey', 'SlateGrey', 'Olive', 'Magenta', 'MediumPurple']
-
 
 class Channels():
     def __init__(self, wlanthermo):
         self.app = wlanthermo.app
         self.db = wlanthermo.db
         self.logger = logging.getLogger(__name__)
-        self.channels = dict()
+        self.state = ChannelState()
+        self.colors = ColorAllocator()
+        with self.app.app_context():
+            self.state.load(self.db)
+            self.colors.seed(color for (color,) in self.db.session.query(ChannelConfigTable.color))
+        self.persister = ChannelPersister(self.app, self.db, self.state)
+        self.stream = ChannelStream(self.app.json_encoder)
+
+    def start(self):
+        self.persister.start()
+
+    def stop(self):
+        self.persister.stop()
 
     def register_api(self):
         self.app.add_url_rule('/api/colors',
@@ -39,6 +49,8 @@ class Channels():
         self.app.add_url_rule('/api/channels/<int:module_id>/<int:channel_id>',
                               methods=['POST'],
                               view_func=self.register_channel_api)
+        self.app.add_url_rule('/api/channels/stream',
+                              view_func=self.stream_channels_api)
         self.app.add_url_rule('/api/channels/<int:module_id>/<int:channel_id>',
                               view_func=self.get_channels_api)
         self.app.add_url_rule('/api/channels/<int:module_id>',
@@ -48,6 +60,9 @@ class Channels():
         self.app.add_url_rule('/api/channels/<int:module_id>/<int:channel_id>',
                               methods=['PUT'],
                               view_func=self.set_channels_api)
+        self.app.add_url_rule('/api/channels/<int:module_id>',
+                              methods=['PUT'],
+                              view_func=self.set_module_channels_api)
         self.app.add_url_rule('/api/channel_config/<int:module_id>/<int:channel_id>',
                               view_func=self.get_channel_config_api)
         self.app.add_url_rule('/api/channel_config/<int:module_id>',
@@ -73,42 +88,14 @@ class Channels():
         if channel is not None:
             self.db.session.delete(channel)
             self.db.session.commit()
+            self.state.remove_config_id(channel.config_id)
+            self.stream.resync_all()
             return True
         else:
             return False
         
     def get_channels(self, module_id=None, channel_id=None):
-        query = self.db.session.query(ChannelConfigTable, ChannelsTable).filter(
-            ChannelConfigTable.id == ChannelsTable.config_id)
-        
-        if channel_id is not None:
-            query.filter(ChannelConfigTable.channel_id == channel_id)
-        if module_id is not None:
-            query.filter(ChannelConfigTable.module_id == module_id)
-        db_result = query.order_by(ChannelConfigTable.module_id).order_by(ChannelConfigTable.channel_id).all()
-        
-        result = dict()
-        for channel_config, channel in db_result:
-            if channel_config.module_id not in result:
-                result[channel_config.module_id] = dict()
-            result[channel_config.module_id][channel_config.channel_id] = {
-                'type': channel_config.type,
-                'module_id': channel_config.module_id,
-                'channel_id': channel_config.channel_id,
-                'name': channel_config.name,
-                'unit': channel_config.unit,
-                'sensor_type': channel_config.sensor_type,
-                'alert_low_limit': channel_config.alert_low_limit,
-                'alert_high_limit': channel_config.alert_high_limit,
-                'alert_low_enabled': channel_config.alert_low_enabled,
-                'alert_high_enabled': channel_config.alert_high_enabled,
-                'color': channel_config.color,
-                'description': channel_config.description,
-                'value': channel.value,
-                'timestamp': channel.timestamp,
-                'alert_state': channel.alert_state,
-                'alert_ack': channel.alert_ack,
-            }
+        result = self.state.select(module_id, channel_id)
         
         if channel_id is not None and module_id is not None:
             try:
@@ -126,6 +113,21 @@ class Channels():
             self.logger.error('Irregular Filter in get_channels')
             return None
         
+    def get_channels_delta(self, since, module_id=None, channel_id=None):
+        """
+        Returns the channels changed after sequence number since and the current sequence number
+        Falls back to all channels if since is not in the change log anymore
+        """
+        with self.state.lock:
+            seq = self.state.version
+            keys = self.state.changes_since(since)
+            if keys is None:
+                return {'seq': seq, 'full': True, 'channels': self.state.select(module_id, channel_id)}
+            keys = [(key_module_id, key_channel_id) for key_module_id, key_channel_id in keys
+                    if (module_id is None or key_module_id == module_id) and
+                    (channel_id is None or key_channel_id == channel_id)]
+            return {'seq': seq, 'full': False, 'channels': self.state.collect(keys)}
+
     def set_channel_config(self, config, module_id=None, channel_id=None):
         # Put into right structure
         if channel_id is not None:
@@ -133,62 +135,72 @@ class Channels():
         if module_id is not None:
             config = {module_id: config}
         
+        config = {int(config_module_id): {int(config_channel_id): channel_config
+                                           for config_channel_id, channel_config in module_level_config.items()}
+                  for config_module_id, module_level_config in config.items()}
+        
+        # Load all affected channels at once
+        keys = [(config_module_id, config_channel_id)
+                for config_module_id, module_level_config in config.items()
+                for config_channel_id in module_level_config]
+        if not keys:
+            return
+        channel_config_list = self.db.session.query(ChannelConfigTable) \
+            .filter(tuple_(ChannelConfigTable.module_id, ChannelConfigTable.channel_id).in_(keys)) \
+            .all()
+        
         updated_channel_list = []
+        color_changes = []
         
         # Set configuration to database
-        for module_id, module_level_config in config.items():
-            for channel_id, channel_config in module_level_config.items():
-                channel_config_db = self.db.session.query(ChannelConfigTable) \
-                    .filter(ChannelConfigTable.module_id == module_id) \
-                    .filter(ChannelConfigTable.channel_id == channel_id) \
-                    .first()
-                updated = False
-                for key, value in channel_config:
-                    if key not in ('module_id', 'channel_id', 'id'):
-                        try:
-                            setattr(channel_config_db, key, value)
-                            self.logger.debug('Set key {key} to {value}'.format(key=key, value=value))
-                            updated = True
-                        except AttributeError:
-                            self.logger.warning('Key {key} not in channel_config'.format(key=key))
+        for channel_config_db in channel_config_list:
+            module_id = channel_config_db.module_id
+            channel_id = channel_config_db.channel_id
+            updated = False
+            for key, value in config[module_id][channel_id].items():
+                if key not in ('module_id', 'channel_id', 'id'):
+                    if key in ChannelConfigTable.__table__.columns.keys():
+                        if key == 'color' and value != channel_config_db.color:
+                            color_changes.append((channel_config_db.color, value))
+                        setattr(channel_config_db, key, value)
+                        self.logger.debug('Set key {key} to {value}'.format(key=key, value=value))
+                        updated = True
                     else:
-                        self.logger.debug('Key {key} not to be set!'.format(key=key))
-                if updated:
-                    updated_channel_list.append((module_id, channel_id))
+                        self.logger.warning('Key {key} not in channel_config'.format(key=key))
+                else:
+                    self.logger.debug('Key {key} not to be set!'.format(key=key))
+            if updated:
+                updated_channel_list.append((module_id, channel_id))
         
-        self.db.session.commit()
-        
-        for module_id, channel_id in updated_channel_list:
-            self.process(module_id, channel_id, reprocess=True)
-        
-    def get_channel_config(self, module_id=None, channel_id=None):
-        query = self.db.session.query(ChannelConfigTable)
+        # Re-evaluate alerts of all updated channels and write config and alert states in one commit
+        try:
+            # Read the rows back, so the state gets values of the column types and not the request values
+            self.db.session.flush()
+            for channel_config_db in channel_config_list:
+                if (channel_config_db.module_id, channel_config_db.channel_id) in updated_channel_list:
+                    self.db.session.refresh(channel_config_db)
+            with self.state.lock:
+                for channel_config_db in channel_config_list:
+                    key = (channel_config_db.module_id, channel_config_db.channel_id)
+                    if key in updated_channel_list:
+                        self.state.set_config(channel_config_db)
+                        self._apply(self.state.get(*key), reprocess=True)
+                self.state.changed(updated_channel_list)
+            self.persister.execute(updated_channel_list)
+            self.db.session.commit()
+        except Exception:
+            self.db.session.rollback()
+            self.state.load(self.db)
+            raise
         
-        if channel_id is not None:
-            query.filter(ChannelConfigTable.channel_id == channel_id)
-        if module_id is not None:
-            query.filter(ChannelConfigTable.module_id == module_id)
+        for old_color, new_color in color_changes:
+            self.colors.release(old_color)
+            self.colors.reserve(new_color)
         
-        db_result = query.order_by(ChannelConfigTable.module_id).order_by(ChannelConfigTable.channel_id).all()
+        self.publish(updated_channel_list)
         
-        result = dict()
-        for channel_config in db_result:
-            if channel_config.module_id not in result:
-                result[channel_config.module_id] = dict()
-            result[channel_config.module_id][channel_config.channel_id] = {
-                'type': channel_config.type,
-                'module_id': channel_config.module_id,
-                'channel_id': channel_config.channel_id,
-                'name': channel_config.name,
-                'unit': channel_config.unit,
-                'sensor_type': channel_config.sensor_type,
-                'alert_low_limit': channel_config.alert_low_limit,
-                'alert_high_limit': channel_config.alert_high_limit,
-                'alert_low_enabled': channel_config.alert_low_enabled,
-                'alert_high_enabled': channel_config.alert_high_enabled,
-                'color': channel_config.color,
-                'description': channel_config.description,
-            }
+    def get_channel_config(self, module_id=None, channel_id=None):
+        result = self.state.select(module_id, channel_id, CONFIG_KEYS)
         
         if channel_id is not None and module_id is not None:
             try:
@@ -207,14 +219,7 @@ class Channels():
             return result
         
     def get_channel_color(self):
-        for color in PreferredColorList:
-            color_hex = webcolors.name_to_hex(color)
-            if self.db.session.query(ChannelConfigTable).filter_by(color=color_hex).first() is None:
-                self.logger.info('Color {color} not in use yet.'.format(color=color))
-                return color_hex
-        else:
-            self.logger.error('No free color found')
-            return '#000000'
+        return self.colors.allocate()
         
     def register(self, module_id, channel_id, unit):
         self.logger.info('Registering module {module_id}, channel {channel_id} with type {unit}'.format(
@@ -259,40 +264,98 @@ class Channels():
         
         self.db.session.commit()
         
+        self.state.set_config(channel_config)
+        self.state.set_values(module_id, channel_id, channel)
+        self.publish([(module_id, channel_id)])
+        
         return channel_config.id
 
-    def process(self, module_id, channel_id, value=None, timestamp=None, reprocess=False):
-        channel_config = self.db.session.query(ChannelConfigTable).filter_by(module_id=module_id, channel_id=channel_id).one()
-        channel = self.db.session.query(ChannelsTable).filter_by(config_id=channel_config.id).one()
+    def is_registered(self, module_id, channel_id):
+        with self.state.lock:
+            try:
+                self.state.get(module_id, channel_id)
+            except UnknownChannelError:
+                return False
+        return True
 
+    def process(self, module_id, channel_id, value=None, timestamp=None, reprocess=False):
         self.logger.debug('Processing value: {value} for module {module_id}, channel {channel_id}'.format(
             value=value,
             module_id=module_id,
             channel_id=channel_id
         ))
 
-        old_alert_state = channel.alert_state
+        with self.state.lock:
+            sample = self._apply(self.state.get(module_id, channel_id), value, timestamp, reprocess)
+            self.state.changed([(module_id, channel_id)])
+
+        self.persister.mark_dirty(module_id, channel_id)
         if not reprocess:
-            channel.value = value
-            if timestamp is not None:
-                channel.timestamp = timestamp
+            values_processed.send(self, samples=[sample])
+            self.publish([(module_id, channel_id)])
+
+        return True
+
+    def process_batch(self, module_id, cycles):
+        """
+        Processes the values of several channels of one module at once
+        cycles is a list of (timestamp, {channel_id: value}) in chronological order,
+        all channels are checked before any value is applied and written in one transaction
+        """
+        self.logger.debug('Processing {count} cycles for module {module_id}'.format(
+            count=len(cycles),
+            module_id=module_id
+        ))
+
+        updated_channel_list = set()
+        samples = []
+        with self.state.lock:
+            for timestamp, values in cycles:
+                for channel_id in values:
+                    self.state.get(module_id, channel_id)
+            for timestamp, values in cycles:
+                for channel_id, value in values.items():
+                    samples.append(self._apply(self.state.get(module_id, channel_id), value, timestamp))
+                    updated_channel_list.add((module_id, channel_id))
+            self.state.changed(updated_channel_list)
+
+        self.persister.mark_dirty_many(updated_channel_list)
+        values_processed.send(self, samples=samples)
+        self.publish(updated_channel_list)
 
-        if channel.value is None:
-            channel.alert_state = AlertState.none
-        elif channel.value > channel_config.alert_high_limit and channel_config.alert_high_enabled:
-            channel.alert_state = AlertState.high
-        elif channel.value < channel_config.alert_low_limit and channel_config.alert_low_enabled:
-            channel.alert_state = AlertState.low
-        else:
-            channel.alert_state = AlertState.ok
-        
-        if not channel.alert_state == old_alert_state:
-            channel.alert_ack = False
-        
-        self.db.session.commit()
-        
         return True
 
+    def publish(self, keys):
+        """
+        Sends the current state of the given (module_id, channel_id) to stream clients
+        """
+        if self.stream.has_subscribers():
+            self.stream.publish(self.state.collect(keys))
+
+    def _apply(self, channel, value=None, timestamp=None, reprocess=False):
+        """
+        Sets a new value to a channel entry and evaluates its alert state, state lock has to be held
+        Returns the accepted value as ChannelSample
+        """
+        old_alert_state = channel['alert_state']
+        if not reprocess:
+            channel['value'] = value
+            if timestamp is not None:
+                channel['timestamp'] = timestamp
+
+        channel['alert_state'] = evaluate_alert(channel)
+
+        if not channel['alert_state'] == old_alert_state:
+            channel['alert_ack'] = False
+
+        return ChannelSample(
+            module_id=channel['module_id'],
+            channel_id=channel['channel_id'],
+            timestamp=timestamp if timestamp is not None else datetime.datetime.utcnow(),
+            value=channel['value'],
+            alert_state=channel['alert_state'],
+        )
+
     def get_colors_api(self):
         return jsonify([(color, webcolors.name_to_hex(color)) for color in PreferredColorList])
 
@@ -300,27 +363,85 @@ class Channels():
         content = request.get_json() or request.form
         return jsonify(self.register(module_id, channel_id, content['unit']))
 
+    def conditional_response(self, build):
+        """
+        Answers with 304 if the client already has the current state version,
+        otherwise with the JSON returned by build() and the version as ETag
+        """
+        # Taken before building, a change in between only makes the ETag older than the content
+        etag = self.state.etag()
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            response = jsonify(build())
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+
     def get_channels_api(self, module_id=None, channel_id=None):
-        channels = self.get_channels(module_id, channel_id)
-        if channels == None:
-            abort(404)
-        return jsonify(channels)
+        since = request.args.get('since', type=int)
+        if since is not None:
+            return self.conditional_response(lambda: self.get_channels_delta(since, module_id, channel_id))
+
+        def build():
+            channels = self.get_channels(module_id, channel_id)
+            if channels == None:
+                abort(404)
+            return channels
+        return self.conditional_response(build)
+
+    def stream_channels_api(self):
+        """
+        Server-Sent Events: a "snapshot" event with all channels, then "update" events with changed channels
+        """
+        response = Response(self.stream.events(self.get_channels), mimetype='text/event-stream')
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['X-Accel-Buffering'] = 'no'
+        return response
 
     def set_channels_api(self, module_id, channel_id):
         content = request.get_json() or request.form
         try:
-            timestamp = content['timestamp']
-        except KeyError:
-            timestamp = None
-        value = float(content['value'])
+            timestamp = parse_timestamp(content.get('timestamp'))
+            value = float(content['value'])
+        except (KeyError, TypeError, ValueError):
+            abort(400)
 
-        return jsonify(self.process(module_id, channel_id, value, timestamp))
+        try:
+            return jsonify(self.process(module_id, channel_id, value, timestamp))
+        except UnknownChannelError:
+            abort(404)
 
-    def get_channel_config_api(self, module_id=None, channel_id=None):
-        channel_config = self.get_channel_config(module_id, channel_id)
-        if channel_config == None:
+    def set_module_channels_api(self, module_id):
+        """
+        Takes all channels of one module cycle as
+        {"timestamp": ..., "channels": {"<channel_id>": <value>, ...}}
+        or several buffered cycles as {"cycles": [<cycle>, ...]}
+        """
+        content = request.get_json()
+        if content is None:
+            abort(400)
+        try:
+            cycles = []
+            for cycle in content.get('cycles', [content]):
+                values = {int(channel_id): None if value is None else float(value)
+                          for channel_id, value in cycle['channels'].items()}
+                cycles.append((parse_timestamp(cycle.get('timestamp')), values))
+        except (KeyError, TypeError, ValueError, AttributeError):
+            abort(400)
+
+        try:
+            return jsonify(self.process_batch(module_id, cycles))
+        except UnknownChannelError:
             abort(404)
-        return jsonify(channel_config)
+
+    def get_channel_config_api(self, module_id=None, channel_id=None):
+        def build():
+            channel_config = self.get_channel_config(module_id, channel_id)
+            if channel_config == None:
+                abort(404)
+            return channel_config
+        return self.conditional_response(build)
 
     def set_channel_config_api(self, module_id=None, channel_id=None):
         content = request.get_json() or request.form
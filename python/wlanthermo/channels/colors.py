@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+import colorsys
+import heapq
+import logging
+import threading
+from collections import Counter
+import webcolors
+
+__author__ = 'Björn Schrader <wlanthermo@bjoern-schrader.de>'
+__license__ = 'GNU General Public License http://www.gnu.org/licenses/gpl.html'
+__copyright__ = 'Copyright (C) 2017 by WLANThermo Project - Released under terms of the GPLv3 License'
+
+PreferredColorList = ['Blue', 'Chartreuse', 'Aquamarine', 'Yellow', 'HotPink', 'Red', 'Purple', 'Green', 'Orange',
+                      'Black', 'White', 'Brown', 'Plum', 'SkyBlue', 'OrangeRed', 'Salmon', 'DarkGrey', 'Violet',
+                      'Turquoise', 'Khaki', 'DarkViolet', 'SeaGreen', 'SteelBlue', 'Gold', 'DarkGreen', 'MidnightBlue',
+                      'DarkKhaki', 'DarkOliveGreen', 'Pink', 'Grey', 'SlateGrey', 'Olive', 'Magenta', 'MediumPurple']
+
+# Hue step of generated colors, the golden ratio spreads any number of hues evenly
+GOLDEN_RATIO_CONJUGATE = 0.618033988749895
+
+
+def generated_color(index):
+    """
+    Returns the index-th generated color, used once all preferred colors are taken
+
+    >>> generated_color(0)
+    '#bf7e1c'
+    """
+    hue = (0.1 + index * GOLDEN_RATIO_CONJUGATE) % 1
+    saturation = 0.65 if index % 2 else 0.85
+    value = 0.95 if (index // 2) % 2 else 0.75
+    red, green, blue = colorsys.hsv_to_rgb(hue, saturation, value)
+    return '#{:02x}{:02x}{:02x}'.format(int(red * 255), int(green * 255), int(blue * 255))
+
+
+class ColorAllocator:
+    """
+    Hands out channel colors, preferred colors first
+
+    Colors in use are counted in memory, seeded once from channel_config.
+    Free preferred colors are kept in a heap by preference, so allocating
+    and releasing never touches the database.
+    """
+    def __init__(self, preferred=PreferredColorList):
+        self.logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._preferred = {webcolors.name_to_hex(color): index for index, color in enumerate(preferred)}
+        self._used = Counter()
+        self._free = [(index, color) for color, index in self._preferred.items()]
+        self._generated = 0
+
+    def seed(self, colors):
+        """
+        Marks the colors of the existing channel configurations as used
+        """
+        with self._lock:
+            self._used = Counter(color.lower() for color in colors if color)
+            self._free = [(index, color) for color, index in self._preferred.items() if color not in self._used]
+            heapq.heapify(self._free)
+
+    def allocate(self):
+        with self._lock:
+            while self._free:
+                index, color = heapq.heappop(self._free)
+                # Could have been set manually in the meantime
+                if color not in self._used:
+                    self._used[color] += 1
+                    self.logger.info('Color {color} not in use yet.'.format(color=color))
+                    return color
+            while True:
+                color = generated_color(self._generated)
+                self._generated += 1
+                if color not in self._used:
+                    self._used[color] += 1
+                    self.logger.info('All preferred colors in use, generated color {color}.'.format(color=color))
+                    return color
+
+    def reserve(self, color):
+        """
+        Marks a color chosen by the user as used
+        """
+        if not color:
+            return
+        with self._lock:
+            self._used[color.lower()] += 1
+
+    def release(self, color):
+        """
+        Gives a color back once no channel uses it anymore
+        """
+        if not color:
+            return
+        color = color.lower()
+        with self._lock:
+            if self._used[color] > 1:
+                self._used[color] -= 1
+                return
+            del self._used[color]
+            if color in self._preferred:
+                heapq.heappush(self._free, (self._preferred[color], color))
@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+import datetime
+import logging
+import threading
+import time
+import uuid
+from collections import namedtuple, deque
+from threading import Thread
+from blinker import Namespace
+from sqlalchemy import bindparam
+from wlanthermo.database.tables import *
+
+__author__ = 'Björn Schrader <wlanthermo@bjoern-schrader.de>'
+__license__ = 'GNU General Public License http://www.gnu.org/licenses/gpl.html'
+__copyright__ = 'Copyright (C) 2017 by WLANThermo Project - Released under terms of the GPLv3 License'
+
+# Seconds between two writes of changed channel values to the database
+PERSIST_INTERVAL = 1.0
+
+# Changes kept for delta queries, older sequence numbers get a full snapshot
+CHANGE_LOG_SIZE = 1000
+
+CONFIG_KEYS = ('type', 'module_id', 'channel_id', 'name', 'unit', 'sensor_type', 'alert_low_limit',
+               'alert_high_limit', 'alert_low_enabled', 'alert_high_enabled', 'color', 'description')
+
+STATE_KEYS = ('value', 'timestamp', 'alert_state', 'alert_ack')
+
+ChannelSample = namedtuple('ChannelSample',
+                           ('module_id', 'channel_id', 'timestamp', 'value', 'alert_state'))
+
+channel_signals = Namespace()
+
+# Sent by Channels with samples=[ChannelSample, ...] for every accepted value
+values_processed = channel_signals.signal('values-processed')
+
+
+TIMESTAMP_FORMATS = ('%Y-%m-%d %H:%M:%S.%f', '%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S')
+
+
+class UnknownChannelError(Exception):
+    pass
+
+
+def parse_timestamp(timestamp):
+    """
+    Parses a timestamp as sent by modules (str() or isoformat() of a naive UTC datetime)
+
+    >>> parse_timestamp('2017-05-01 12:34:56.789000')
+    datetime.datetime(2017, 5, 1, 12, 34, 56, 789000)
+    """
+    if timestamp is None or isinstance(timestamp, datetime.datetime):
+        return timestamp
+    for timestamp_format in TIMESTAMP_FORMATS:
+        try:
+            return datetime.datetime.strptime(timestamp, timestamp_format)
+        except ValueError:
+            continue
+    raise ValueError('Invalid timestamp "{timestamp}"'.format(timestamp=timestamp))
+
+
+def evaluate_alert(channel):
+    """
+    Returns the alert state of a channel dict holding value and limits
+    """
+    if channel['value'] is None:
+        return AlertState.none
+    elif channel['alert_high_enabled'] and channel['value'] > channel['alert_high_limit']:
+        return AlertState.high
+    elif channel['alert_low_enabled'] and channel['value'] < channel['alert_low_limit']:
+        return AlertState.low
+    else:
+        return AlertState.ok
+
+
+class ChannelState:
+    """
+    In-memory copy of channel_config and channels, keyed by (module_id, channel_id)
+
+    All reads and alert evaluations are served from here, the database is
+    updated by the ChannelPersister in the background. Callers modifying an
+    entry have to hold self.lock and call changed() afterwards.
+
+    version is increased by every change, together with an id unique to
+    this process it is used as ETag of the read APIs. The channels touched
+    by the last CHANGE_LOG_SIZE changes are kept in a ring for delta
+    queries. version starts at the current time in milliseconds, so
+    sequence numbers of an earlier run are outside of the ring.
+    """
+    def __init__(self, change_log_size=CHANGE_LOG_SIZE):
+        self.lock = threading.RLock()
+        self._channels = dict()
+        self._config_ids = dict()
+        self.version = int(time.time() * 1000)
+        self._epoch = uuid.uuid4().hex[:8]
+        self._change_log = deque(maxlen=change_log_size)
+        # All changes after this version are in _change_log
+        self._change_log_base = self.version
+
+    def changed(self, keys=None):
+        """
+        Marks the given (module_id, channel_id) as changed, returns the new version
+        Without keys (e.g. a channel was removed) delta queries from before get a full snapshot
+        """
+        with self.lock:
+            self.version += 1
+            if keys is None:
+                self._change_log.clear()
+                self._change_log_base = self.version
+            else:
+                if len(self._change_log) == self._change_log.maxlen:
+                    self._change_log_base = self._change_log[0][0]
+                self._change_log.append((self.version, tuple(keys)))
+            return self.version
+
+    def changes_since(self, since):
+        """
+        Returns the set of (module_id, channel_id) changed after version since,
+        None if that is not known anymore and a full snapshot is needed
+        """
+        with self.lock:
+            if since < self._change_log_base or since > self.version:
+                return None
+            keys = set()
+            for version, entry_keys in reversed(self._change_log):
+                if version <= since:
+                    break
+                keys.update(entry_keys)
+            return keys
+
+    def etag(self):
+        return '{epoch}-{version}'.format(epoch=self._epoch, version=self.version)
+
+    def load(self, db):
+        """
+        Replaces the whole state by the contents of the database
+        """
+        db_result = db.session.query(ChannelConfigTable, ChannelsTable).filter(
+            ChannelConfigTable.id == ChannelsTable.config_id).all()
+        with self.lock:
+            self._channels = dict()
+            self._config_ids = dict()
+            for channel_config, channel in db_result:
+                self.set_config(channel_config)
+                self.set_values(channel_config.module_id, channel_config.channel_id, channel)
+            self.changed(None)
+
+    def set_config(self, channel_config):
+        """
+        Takes over the configuration of a ChannelConfigTable row
+        """
+        key = (channel_config.module_id, channel_config.channel_id)
+        with self.lock:
+            entry = self._channels.setdefault(key, {state_key: None for state_key in STATE_KEYS})
+            for config_key in CONFIG_KEYS:
+                entry[config_key] = getattr(channel_config, config_key)
+            self._config_ids[key] = channel_config.id
+            self.changed([key])
+
+    def set_values(self, module_id, channel_id, channel):
+        """
+        Takes over the current values of a ChannelsTable row
+        """
+        with self.lock:
+            entry = self._channels[(module_id, channel_id)]
+            for state_key in STATE_KEYS:
+                entry[state_key] = getattr(channel, state_key)
+            self.changed([(module_id, channel_id)])
+
+    def remove_config_id(self, config_id):
+        with self.lock:
+            for key, entry_config_id in list(self._config_ids.items()):
+                if entry_config_id == config_id:
+                    del self._config_ids[key]
+                    del self._channels[key]
+                    self.changed(None)
+
+    def get(self, module_id, channel_id):
+        """
+        Returns the live entry of a channel, only to be used while holding self.lock
+        """
+        try:
+            return self._channels[(module_id, channel_id)]
+        except KeyError:
+            raise UnknownChannelError('Module {module_id}, channel {channel_id} is not registered'.format(
+                module_id=module_id,
+                channel_id=channel_id))
+
+    def select(self, module_id=None, channel_id=None, keys=None):
+        """
+        Returns copies of the matching entries as {module_id: {channel_id: channel}}
+        """
+        if keys is None:
+            keys = CONFIG_KEYS + STATE_KEYS
+        result = dict()
+        with self.lock:
+            for (entry_module_id, entry_channel_id), entry in sorted(self._channels.items()):
+                if module_id is not None and entry_module_id != module_id:
+                    continue
+                if channel_id is not None and entry_channel_id != channel_id:
+                    continue
+                result.setdefault(entry_module_id, dict())[entry_channel_id] = {key: entry[key] for key in keys}
+        return result
+
+    def collect(self, keys):
+        """
+        Returns copies of the given (module_id, channel_id) entries as {module_id: {channel_id: channel}}
+        """
+        result = dict()
+        with self.lock:
+            for module_id, channel_id in sorted(keys):
+                try:
+                    entry = self._channels[(module_id, channel_id)]
+                except KeyError:
+                    continue
+                result.setdefault(module_id, dict())[channel_id] = {
+                    key: entry[key] for key in CONFIG_KEYS + STATE_KEYS}
+        return result
+
+    def persist_rows(self, keys):
+        """
+        Returns the parameters to write the current values of the given channels
+        """
+        rows = []
+        with self.lock:
+            for key in keys:
+                try:
+                    entry = self._channels[key]
+                    config_id = self._config_ids[key]
+                except KeyError:
+                    # Unregistered in the meantime
+                    continue
+                row = {state_key: entry[state_key] for state_key in STATE_KEYS}
+                row['b_config_id'] = config_id
+                rows.append(row)
+        return rows
+
+
+class ChannelPersister(Thread):
+    """
+    Writes changed channel values from ChannelState to the channels table
+
+    Changes are collected and written every PERSIST_INTERVAL seconds with
+    one executemany and one commit, so processing a value never waits on
+    the database.
+    """
+    def __init__(self, app, db, state, interval=PERSIST_INTERVAL):
+        super().__init__(name='ChannelPersister', daemon=True)
+        self.logger = logging.getLogger(__name__)
+        self.app = app
+        self.db = db
+        self.state = state
+        self.interval = interval
+        self._dirty = set()
+        self._dirty_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._running = True
+        self._statement = ChannelsTable.__table__.update().where(
+            ChannelsTable.__table__.c.config_id == bindparam('b_config_id'))
+
+    def mark_dirty(self, module_id, channel_id):
+        with self._dirty_lock:
+            self._dirty.add((module_id, channel_id))
+
+    def mark_dirty_many(self, keys):
+        """
+        Marks several (module_id, channel_id) at once, so they end up in the same transaction
+        """
+        with self._dirty_lock:
+            self._dirty.update(keys)
+
+    def run(self):
+        with self.app.app_context():
+            while self._running:
+                self._wakeup.wait(self.interval)
+                self._wakeup.clear()
+                self.flush()
+            # Write what is left before shutting down
+            self.flush()
+
+    def stop(self):
+        self._running = False
+        self._wakeup.set()
+        if self.is_alive():
+            self.join()
+
+    def flush(self):
+        with self._dirty_lock:
+            dirty, self._dirty = self._dirty, set()
+        try:
+            count = self.execute(dirty)
+            if not count:
+                return 0
+            self.db.session.commit()
+        except Exception:
+            self.logger.exception('Writing {count} channel values failed, retrying later'.format(count=len(dirty)))
+            self.db.session.rollback()
+            with self._dirty_lock:
+                self._dirty.update(dirty)
+            return 0
+        self.logger.debug('Wrote {count} channel values'.format(count=count))
+        return count
+
+    def execute(self, keys):
+        """
+        Writes the current values of the given channels within the current transaction
+        """
+        rows = self.state.persist_rows(keys)
+        if rows:
+            self.db.session.execute(self._statement, rows)
+        return len(rows)
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+import json
+import logging
+import queue
+import threading
+
+__author__ = 'Björn Schrader <wlanthermo@bjoern-schrader.de>'
+__license__ = 'GNU General Public License http://www.gnu.org/licenses/gpl.html'
+__copyright__ = 'Copyright (C) 2017 by WLANThermo Project - Released under terms of the GPLv3 License'
+
+# Events waiting per client, a client falling further behind gets a new snapshot
+STREAM_QUEUE_SIZE = 100
+# Seconds after which a comment is sent to detect closed connections
+STREAM_KEEPALIVE = 15
+
+
+class StreamSubscriber:
+    def __init__(self, queue_size=STREAM_QUEUE_SIZE):
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.resync = True
+
+
+class ChannelStream:
+    """
+    Fans out channel changes to all connected Server-Sent Events clients
+
+    Every change is serialized once and the same event is queued for all
+    subscribers, so the cost does not depend on the number of clients.
+    """
+    def __init__(self, json_encoder=None):
+        self.logger = logging.getLogger(__name__)
+        self.json_encoder = json_encoder
+        self._subscribers = set()
+        self._subscribers_lock = threading.Lock()
+
+    def has_subscribers(self):
+        return bool(self._subscribers)
+
+    def format_event(self, event, data):
+        return 'event: {event}\ndata: {data}\n\n'.format(
+            event=event,
+            data=json.dumps(data, cls=self.json_encoder))
+
+    def publish(self, channels, event='update'):
+        """
+        Queues {module_id: {channel_id: channel}} for all subscribers
+        """
+        with self._subscribers_lock:
+            subscribers = list(self._subscribers)
+        if not subscribers:
+            return
+        message = self.format_event(event, channels)
+        for subscriber in subscribers:
+            try:
+                subscriber.queue.put_nowait(message)
+            except queue.Full:
+                subscriber.resync = True
+
+    def resync_all(self):
+        """
+        Makes all subscribers start over with a snapshot, e.g. after a channel was removed
+        """
+        with self._subscribers_lock:
+            for subscriber in self._subscribers:
+                subscriber.resync = True
+                try:
+                    subscriber.queue.put_nowait(None)
+                except queue.Full:
+                    pass
+
+    def events(self, get_snapshot, keepalive=STREAM_KEEPALIVE):
+        """
+        Generator of the event stream for one client
+        get_snapshot is called for the initial snapshot and after the client fell behind
+        """
+        subscriber = StreamSubscriber()
+        with self._subscribers_lock:
+            self._subscribers.add(subscriber)
+        self.logger.debug('Stream client connected, {count} connected'.format(count=len(self._subscribers)))
+        try:
+            while True:
+                if subscriber.resync:
+                    subscriber.resync = False
+                    # Updates queued so far are contained in the snapshot
+                    while not subscriber.queue.empty():
+                        subscriber.queue.get_nowait()
+                    yield self.format_event('snapshot', get_snapshot())
+                try:
+                    message = subscriber.queue.get(timeout=keepalive)
+                except queue.Empty:
+                    yield ': keepalive\n\n'
+                    continue
+                if message is not None:
+                    yield message
+        finally:
+            with self._subscribers_lock:
+                self._subscribers.discard(subscriber)
+            self.logger.debug('Stream client disconnected, {count} connected'.format(count=len(self._subscribers)))
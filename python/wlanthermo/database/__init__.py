@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+import logging
+import sqlalchemy
+from sqlalchemy import inspect
+from wlanthermo.database.tables import Base
+
+__author__ = 'Björn Schrader <wlanthermo@bjoern-schrader.de>'
+__license__ = 'GNU General Public License http://www.gnu.org/licenses/gpl.html'
+__copyright__ = 'Copyright (C) 2017 by WLANThermo Project - Released under terms of the GPLv3 License'
+
+
+def migrate_database(engine, metadata=Base.metadata):
+    """
+    Adds indexes declared on the models to tables created by an older version
+
+    create_all() only creates missing tables, so indexes added later have to be
+    created here. A unique index fails if the table already holds duplicates,
+    this is logged and the remaining indexes are still created.
+    Returns the names of the created indexes.
+    """
+    logger = logging.getLogger(__name__)
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    created = []
+    for table in metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing_indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing_indexes:
+                continue
+            logger.info('Creating index "{index}" on table "{table}"'.format(index=index.name, table=table.name))
+            try:
+                index.create(engine)
+            except sqlalchemy.exc.IntegrityError:
+                logger.error('Index "{index}" could not be created, table "{table}" contains duplicates!'.format(
+                    index=index.name,
+                    table=table.name))
+            else:
+                created.append(index.name)
+    return created
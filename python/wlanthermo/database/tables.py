@@ -4,9 +4,10 @@
 import datetime
 import enum
 import json
-from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.ext.declarative import declarative_base, declared_attr
 from sqlalchemy.ext import mutable
-from sqlalchemy import inspect, TypeDecorator, Column, Integer, String, ForeignKey, DateTime, Enum, Float, Boolean, JSON
+from sqlalchemy import inspect, TypeDecorator, Column, Integer, String, ForeignKey, DateTime, Enum, Float, Boolean, JSON, \
+    Index
 from sqlalchemy.orm import relationship
 
 __author__ = 'Björn Schrader <wlanthermo@bjoern-schrader.de>'
@@ -57,6 +58,9 @@ class SettingsTable(Base, Dictable):
     """Die aktuellen Kanaldaten
     """
     __tablename__ = 'settings'
+    __table_args__ = (
+        Index('ix_settings_scope_key', 'scope', 'key', unique=True),
+    )
     id = Column(Integer, primary_key=True)
     scope = Column(String(50))
     key = Column(String(50))
@@ -67,6 +71,9 @@ class ChannelsTable(Base, Dictable):
     """Die aktuellen Kanaldaten
     """
     __tablename__ = 'channels'
+    __table_args__ = (
+        Index('ix_channels_config_id', 'config_id', unique=True),
+    )
     id = Column(Integer, primary_key=True)
     config_id = Column(Integer, ForeignKey('channel_config.id'))
     value = Column(Float)
@@ -79,6 +86,9 @@ class ChannelConfigTable(Base, Dictable):
     """Die aktuelle Kanalkonfiguration
     """
     __tablename__ = 'channel_config'
+    __table_args__ = (
+        Index('ix_channel_config_module_id_channel_id', 'module_id', 'channel_id', unique=True),
+    )
     id = Column(Integer, primary_key=True)
     type = Column(Enum(ChannelType))
     module_id = Column(Integer)
@@ -98,6 +108,9 @@ class ModulesTable(Base, Dictable):
     """Die aktuellen Kanaldaten
     """
     __tablename__ = 'modules'
+    __table_args__ = (
+        Index('ix_modules_name', 'name'),
+    )
     id = Column(Integer, primary_key=True)
     name = Column(String(40))
     registered = Column(DateTime, default=datetime.datetime.utcnow)
@@ -169,6 +182,9 @@ class LogData(Base, Dictable):
     """Geloggte Daten
     """
     __tablename__ = 'log_data'
+    __table_args__ = (
+        Index('ix_log_data_pen_id_timestamp', 'pen_id', 'timestamp'),
+    )
     id = Column(Integer, primary_key=True)
     pen_id = Column(Integer, ForeignKey('log_channels.pen_id'))
     timestamp = Column(DateTime)
@@ -207,3 +223,38 @@ class LogChannelAnnotations(Base, Dictable):
     event_id = Column(Integer, ForeignKey('log_events.id'))
     timestamp = Column(DateTime)
     description = Column(String(500))
+
+
+class LogRollup(Dictable):
+    """Minimum, Maximum, Summe und Anzahl der Werte eines Zeitabschnitts
+    """
+    id = Column(Integer, primary_key=True)
+    bucket = Column(DateTime)
+    min = Column(Float)
+    max = Column(Float)
+    sum = Column(Float)
+    count = Column(Integer)
+
+    @declared_attr
+    def pen_id(cls):
+        return Column(Integer, ForeignKey('log_channels.pen_id'))
+
+
+class LogRollupMinute(Base, LogRollup):
+    """Verdichtete Daten pro Minute
+    """
+    __tablename__ = 'log_rollup_1m'
+    __table_args__ = (
+        Index('ix_log_rollup_1m_pen_id_bucket', 'pen_id', 'bucket', unique=True),
+    )
+    resolution = 60
+
+
+class LogRollup10Minutes(Base, LogRollup):
+    """Verdichtete Daten pro 10 Minuten
+    """
+    __tablename__ = 'log_rollup_10m'
+    __table_args__ = (
+        Index('ix_log_rollup_10m_pen_id_bucket', 'pen_id', 'bucket', unique=True),
+    )
+    resolution = 600
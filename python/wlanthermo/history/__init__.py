@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+import datetime
+import logging
+import numpy as np
+from flask import jsonify, request, abort
+from sqlalchemy import func
+from wlanthermo.channels import values_processed
+from wlanthermo.database.tables import *
+from wlanthermo.settings import SystemSettings
+from .recorder import *
+from .downsampling import *
+from .rollups import *
+from .retention import *
+
+__author__ = 'Björn Schrader <wlanthermo@bjoern-schrader.de>'
+__license__ = 'GNU General Public License http://www.gnu.org/licenses/gpl.html'
+__copyright__ = 'Copyright (C) 2017 by WLANThermo Project - Released under terms of the GPLv3 License'
+
+# Points returned by the history API if the client does not ask for less
+DEFAULT_POINTS = 1000
+# Upper limit of points per series, regardless of how long the log is
+MAX_POINTS = 5000
+
+
+def datetime_to_ms(timestamps):
+    """
+    Converts a sequence of naive UTC datetimes to milliseconds since epoch
+    """
+    return np.array(timestamps, dtype='datetime64[ms]').astype(np.int64)
+
+
+def ms_to_datetime(ms):
+    return datetime.datetime(1970, 1, 1) + datetime.timedelta(milliseconds=ms)
+
+
+class History():
+    def __init__(self, wlanthermo):
+        self.wlanthermo = wlanthermo
+        self.app = wlanthermo.app
+        self.db = wlanthermo.db
+        self.logger = logging.getLogger(__name__)
+        self.recorder = HistoryRecorder(self.app, self.db)
+        self.retention = Retention(self.db, self.get_retention_config())
+        self.retention_worker = RetentionWorker(self.app, self.retention)
+
+    def get_retention_config(self):
+        """
+        Reads scope "retention" of the system settings, missing keys are added with their defaults
+        """
+        settings = SystemSettings(self.wlanthermo, 'retention')
+        config = dict()
+        missing = dict()
+        for key, default in RETENTION_DEFAULTS.items():
+            try:
+                config[key] = settings[key]
+            except KeyError:
+                self.logger.info('Retention setting "{key}" is missing, using default {default}'.format(
+                    key=key,
+                    default=default))
+                config[key] = missing[key] = default
+        if config['rollups_since'] is None:
+            # First start with rollups, the recorder keeps them up to date from now on
+            config['rollups_since'] = missing['rollups_since'] = int(datetime_to_ms([datetime.datetime.utcnow()])[0])
+        if missing:
+            settings.set(missing)
+        return config
+
+    def register_api(self):
+        self.app.add_url_rule('/api/history/<int:log_id>/<int:pen_id>',
+                              view_func=self.get_series_api)
+        self.app.add_url_rule('/api/history/<int:log_id>/<int:pen_id>/rollup/<int:resolution>',
+                              view_func=self.get_rollup_api)
+        self.app.add_url_rule('/api/history/<int:log_id>/<int:pen_id>/statistics',
+                              view_func=self.get_statistics_api)
+        self.app.add_url_rule('/api/history/retention',
+                              view_func=self.get_retention_api)
+
+    def start(self):
+        values_processed.connect(self.recorder.on_values_processed)
+        self.recorder.start()
+        self.retention_worker.start()
+
+    def stop(self):
+        self.retention_worker.stop()
+        values_processed.disconnect(self.recorder.on_values_processed)
+        self.recorder.stop()
+
+    def get_series(self, log_id, pen_id, start=None, end=None, points=DEFAULT_POINTS, method='lttb'):
+        """
+        Returns the values of a pen between start and end (datetimes, both optional)
+        decimated to at most points points as [[timestamp in ms, value], ...]
+        """
+        pen = self.db.session.query(LogChannels).filter_by(log_id=log_id, pen_id=pen_id).one_or_none()
+        if pen is None:
+            return None
+
+        query = self.db.session.query(LogData.timestamp, LogData.value) \
+            .filter(LogData.pen_id == pen_id) \
+            .filter(LogData.value.isnot(None))
+        if start is not None:
+            query = query.filter(LogData.timestamp >= start)
+        if end is not None:
+            query = query.filter(LogData.timestamp <= end)
+        rows = query.order_by(LogData.timestamp).all()
+
+        if rows:
+            timestamps, values = zip(*rows)
+            x = datetime_to_ms(timestamps)
+            y = np.array(values, dtype=np.float64)
+            indices = METHODS[method](x, y, points)
+            x, y = x[indices], y[indices]
+        else:
+            x, y = [], []
+
+        return {
+            'log_id': log_id,
+            'pen_id': pen_id,
+            'method': method,
+            'raw_count': len(rows),
+            'data': [[int(timestamp), float(value)] for timestamp, value in zip(x, y)],
+        }
+
+    def get_rollup(self, log_id, pen_id, resolution, start=None, end=None):
+        """
+        Returns the rollup rows of a pen as [[bucket start in ms, min, max, avg, count], ...]
+        """
+        table = ROLLUP_TABLES[resolution]
+        pen = self.db.session.query(LogChannels).filter_by(log_id=log_id, pen_id=pen_id).one_or_none()
+        if pen is None:
+            return None
+
+        query = self.db.session.query(table).filter(table.pen_id == pen_id)
+        if start is not None:
+            query = query.filter(table.bucket >= bucket_start(start, resolution))
+        if end is not None:
+            query = query.filter(table.bucket <= end)
+        rows = query.order_by(table.bucket).all()
+
+        buckets = datetime_to_ms([row.bucket for row in rows])
+        return {
+            'log_id': log_id,
+            'pen_id': pen_id,
+            'resolution': resolution,
+            'data': [[int(bucket), row.min, row.max, row.sum / row.count, row.count]
+                     for bucket, row in zip(buckets, rows)],
+        }
+
+    def get_statistics(self, log_id, pen_id):
+        """
+        Returns minimum, maximum, average and count of all values of a pen, read from the coarsest rollup
+        """
+        table = ROLLUP_TABLES[max(ROLLUP_TABLES)]
+        pen = self.db.session.query(LogChannels).filter_by(log_id=log_id, pen_id=pen_id).one_or_none()
+        if pen is None:
+            return None
+
+        minimum, maximum, total, count, first, last = self.db.session.query(
+            func.min(table.min),
+            func.max(table.max),
+            func.sum(table.sum),
+            func.sum(table.count),
+            func.min(table.bucket),
+            func.max(table.bucket),
+        ).filter(table.pen_id == pen_id).one()
+        first, last = (None if bucket is None else int(datetime_to_ms([bucket])[0]) for bucket in (first, last))
+        return {
+            'log_id': log_id,
+            'pen_id': pen_id,
+            'min': minimum,
+            'max': maximum,
+            'avg': total / count if count else None,
+            'count': int(count or 0),
+            'first_bucket': first,
+            'last_bucket': last,
+        }
+
+    def get_rollup_api(self, log_id, pen_id, resolution):
+        if resolution not in ROLLUP_TABLES:
+            abort(404)
+        start = request.args.get('start', type=int)
+        end = request.args.get('end', type=int)
+        rollup = self.get_rollup(
+            log_id,
+            pen_id,
+            resolution,
+            start=ms_to_datetime(start) if start is not None else None,
+            end=ms_to_datetime(end) if end is not None else None)
+        if rollup is None:
+            abort(404)
+        return jsonify(rollup)
+
+    def get_statistics_api(self, log_id, pen_id):
+        statistics = self.get_statistics(log_id, pen_id)
+        if statistics is None:
+            abort(404)
+        return jsonify(statistics)
+
+    def get_retention_api(self):
+        return jsonify({
+            'config': self.retention.config,
+            'last_run': self.retention.last_report,
+        })
+
+    def get_series_api(self, log_id, pen_id):
+        start = request.args.get('start', type=int)
+        end = request.args.get('end', type=int)
+        points = min(request.args.get('points', DEFAULT_POINTS, type=int), MAX_POINTS)
+        method = request.args.get('method', 'lttb')
+        if method not in METHODS or points < 3:
+            abort(400)
+
+        series = self.get_series(
+            log_id,
+            pen_id,
+            start=ms_to_datetime(start) if start is not None else None,
+            end=ms_to_datetime(end) if end is not None else None,
+            points=points,
+            method=method)
+        if series is None:
+            abort(404)
+        return jsonify(series)
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+import numpy as np
+
+__author__ = 'Björn Schrader <wlanthermo@bjoern-schrader.de>'
+__license__ = 'GNU General Public License http://www.gnu.org/licenses/gpl.html'
+__copyright__ = 'Copyright (C) 2017 by WLANThermo Project - Released under terms of the GPLv3 License'
+
+
+def lttb(x, y, threshold):
+    """
+    Largest-Triangle-Three-Buckets downsampling of a series sorted by x
+
+    Keeps the first and last point and picks the point of each bucket
+    spanning the largest triangle with the point picked before and the
+    average of the next bucket. Returns the indices of the picked points.
+
+    >>> lttb(np.arange(10.0), np.array([0, 1, 0, 5, 0, 1, 0, 1, 0, 1.0]), 4).tolist()
+    [0, 3, 6, 9]
+    """
+    length = len(x)
+    if threshold >= length or threshold < 3:
+        return np.arange(length)
+
+    # Bucket borders of the points between first and last point
+    borders = np.linspace(1, length - 1, threshold - 1).astype(np.int64)
+    indices = np.empty(threshold, dtype=np.int64)
+    indices[0] = 0
+    indices[-1] = length - 1
+
+    picked = 0
+    for bucket in range(threshold - 2):
+        start, end = borders[bucket], borders[bucket + 1]
+        if bucket + 2 < len(borders):
+            next_start, next_end = end, borders[bucket + 2]
+        else:
+            next_start, next_end = length - 1, length
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+
+        # Doubled triangle areas of all candidates of this bucket at once
+        areas = np.abs(
+            (x[picked] - avg_x) * (y[start:end] - y[picked]) -
+            (x[picked] - x[start:end]) * (avg_y - y[picked])
+        )
+        picked = start + int(np.argmax(areas))
+        indices[bucket + 1] = picked
+    return indices
+
+
+def minmax_buckets(x, y, buckets):
+    """
+    Splits the x range into equally wide buckets and keeps the minimum and
+    maximum of each bucket, so peaks survive any amount of decimation.
+    Returns the indices of the kept points in x order.
+
+    >>> minmax_buckets(np.arange(8.0), np.array([3, 1, 2, 4, 9, 5, 6, 7.0]), 2).tolist()
+    [1, 3, 4, 5]
+    """
+    length = len(x)
+    if length <= 2 * buckets or buckets < 1:
+        return np.arange(length)
+
+    width = (x[-1] - x[0]) / buckets or 1
+    bucket = np.minimum(((x - x[0]) / width).astype(np.int64), buckets - 1)
+
+    # Sorted by bucket, then value: the first of each bucket is its minimum, the last its maximum
+    order = np.lexsort((y, bucket))
+    sorted_bucket = bucket[order]
+    first = np.flatnonzero(np.r_[True, sorted_bucket[1:] != sorted_bucket[:-1]])
+    last = np.r_[first[1:] - 1, length - 1]
+
+    return np.unique(np.concatenate((order[first], order[last])))
+
+
+METHODS = {
+    'lttb': lambda x, y, points: lttb(x, y, points),
+    'minmax': lambda x, y, points: minmax_buckets(x, y, points // 2),
+}
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+import datetime
+import logging
+import queue
+import time
+from threading import Thread
+from wlanthermo.database.tables import *
+from .rollups import update_rollups
+
+__author__ = 'Björn Schrader <wlanthermo@bjoern-schrader.de>'
+__license__ = 'GNU General Public License http://www.gnu.org/licenses/gpl.html'
+__copyright__ = 'Copyright (C) 2017 by WLANThermo Project - Released under terms of the GPLv3 License'
+
+# Samples waiting to be written, further samples are dropped when full
+QUEUE_SIZE = 10000
+# Write to log_data as soon as this many samples are waiting ...
+FLUSH_SIZE = 500
+# ... or at least every FLUSH_INTERVAL seconds
+FLUSH_INTERVAL = 10.0
+# Rows per INSERT statement
+INSERT_CHUNK_SIZE = 1000
+
+
+class HistoryRecorder(Thread):
+    """
+    Writes the values accepted by Channels to log_data
+
+    Samples are handed over through a bounded queue and written with
+    multi-row inserts, the request path never waits on the database.
+    The rollup tables are updated with every write.
+    Up to one flush window of samples is lost on a crash.
+    """
+    _stop_marker = object()
+
+    def __init__(self, app, db, queue_size=QUEUE_SIZE, flush_size=FLUSH_SIZE, flush_interval=FLUSH_INTERVAL):
+        super().__init__(name='HistoryRecorder', daemon=True)
+        self.logger = logging.getLogger(__name__)
+        self.app = app
+        self.db = db
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.log_id = None
+        self.pens = dict()
+        self.dropped = 0
+        self.written = 0
+
+    def on_values_processed(self, sender, samples):
+        """
+        Receiver for the values_processed signal of Channels
+        """
+        for sample in samples:
+            try:
+                self.queue.put_nowait(sample)
+            except queue.Full:
+                self.dropped += 1
+                if self.dropped % 1000 == 1:
+                    self.logger.warning('History queue is full, {dropped} samples dropped so far'.format(
+                        dropped=self.dropped))
+
+    def run(self):
+        with self.app.app_context():
+            self.start_log()
+            buffer = []
+            deadline = time.monotonic() + self.flush_interval
+            running = True
+            while running:
+                try:
+                    sample = self.queue.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    sample = None
+                if sample is self._stop_marker:
+                    running = False
+                elif sample is not None:
+                    buffer.append(sample)
+                if len(buffer) >= self.flush_size or time.monotonic() >= deadline or not running:
+                    self.flush(buffer)
+                    buffer = []
+                    deadline = time.monotonic() + self.flush_interval
+            self.end_log()
+
+    def stop(self):
+        if self.is_alive():
+            # Blocks until there is space, everything before the marker is written
+            self.queue.put(self._stop_marker)
+            self.join()
+
+    def start_log(self):
+        """
+        Starts a new entry in log_list, all samples are recorded into it
+        """
+        log = LogList(
+            start_time=datetime.datetime.utcnow(),
+            title='Log {start_time:%Y-%m-%d %H:%M}'.format(start_time=datetime.datetime.now()),
+        )
+        self.db.session.add(log)
+        self.db.session.commit()
+        self.log_id = log.log_id
+        self.pens = dict()
+        self.logger.info('Recording history to log {log_id}'.format(log_id=self.log_id))
+
+    def end_log(self):
+        log = self.db.session.query(LogList).get(self.log_id)
+        log.end_time = datetime.datetime.utcnow()
+        self.db.session.commit()
+
+    def get_pens(self, keys):
+        """
+        Returns {(module_id, channel_id): pen_id}, adds missing channels to log_channels
+        """
+        missing = set(keys) - set(self.pens)
+        if missing:
+            for channel_config in self.db.session.query(ChannelConfigTable).all():
+                key = (channel_config.module_id, channel_config.channel_id)
+                if key not in missing:
+                    continue
+                pen = LogChannels(
+                    log_id=self.log_id,
+                    type=channel_config.type,
+                    module_id=channel_config.module_id,
+                    channel_id=channel_config.channel_id,
+                    name=channel_config.name,
+                    description=channel_config.description,
+                )
+                self.db.session.add(pen)
+                self.db.session.flush()
+                self.pens[key] = pen.pen_id
+            self.db.session.commit()
+        return self.pens
+
+    def flush(self, samples):
+        if not samples:
+            return 0
+        try:
+            pens = self.get_pens((sample.module_id, sample.channel_id) for sample in samples)
+            rows = [{
+                'pen_id': pens[(sample.module_id, sample.channel_id)],
+                'timestamp': sample.timestamp,
+                'value': sample.value,
+                'alert_state': sample.alert_state,
+            } for sample in samples if (sample.module_id, sample.channel_id) in pens]
+            for start in range(0, len(rows), INSERT_CHUNK_SIZE):
+                self.db.session.execute(LogData.__table__.insert().values(rows[start:start + INSERT_CHUNK_SIZE]))
+            # Same transaction, so rollups always match log_data
+            update_rollups(self.db.session, rows)
+            self.db.session.commit()
+        except Exception:
+            self.logger.exception('Writing {count} history samples failed, dropping them'.format(count=len(samples)))
+            self.db.session.rollback()
+            return 0
+        self.written += len(rows)
+        self.logger.debug('Wrote {count} history samples'.format(count=len(rows)))
+        return len(rows)
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+import datetime
+import logging
+import threading
+import time
+from threading import Thread
+from wlanthermo.database.tables import *
+from .rollups import ROLLUP_TABLES, update_rollups, bucket_start
+
+__author__ = 'Björn Schrader <wlanthermo@bjoern-schrader.de>'
+__license__ = 'GNU General Public License http://www.gnu.org/licenses/gpl.html'
+__copyright__ = 'Copyright (C) 2017 by WLANThermo Project - Released under terms of the GPLv3 License'
+
+# Defaults of the "retention" config scope, ages in days, 0 keeps data forever
+RETENTION_DEFAULTS = {
+    'raw_days': 30,
+    'rollup_1m_days': 365,
+    'rollup_10m_days': 0,
+    'chunk_size': 2000,
+    'chunk_pause': 0.1,
+    'interval': 3600,
+    # ms since epoch when rollups were introduced, set on the first start. Older raw
+    # samples are not in the rollups and are merged into them before they are deleted
+    'rollups_since': None,
+}
+
+
+class Retention:
+    """
+    Deletes old rows from log_data and the rollup tables
+
+    Raw samples are merged into the rollups before they are deleted if
+    they were written before config['rollups_since'], when rollups did not
+    exist yet. Minute rollups are kept at least as long as raw samples, as
+    the raw samples are the source of them. Rows are deleted by primary
+    key in chunks of chunk_size with a pause in between, so no long table
+    lock blocks the recorder.
+    """
+    def __init__(self, db, config):
+        self.logger = logging.getLogger(__name__)
+        self.db = db
+        self.config = config
+        self.last_report = None
+        raw_days, minute_days = config['raw_days'], config['rollup_1m_days']
+        if minute_days and (not raw_days or minute_days < raw_days):
+            self.logger.warning('Keeping 1m rollups for {raw_days} days like raw samples instead of {days}'.format(
+                raw_days=raw_days or 'all',
+                days=minute_days))
+            config['rollup_1m_days'] = raw_days
+
+    def run(self, now=None):
+        """
+        Applies the retention policy once, returns the number of deleted rows per table
+        """
+        if now is None:
+            now = datetime.datetime.utcnow()
+        started = time.monotonic()
+        report = {LogData.__tablename__: 0}
+        if self.config['raw_days']:
+            report[LogData.__tablename__] = self.purge_raw(now - datetime.timedelta(days=self.config['raw_days']))
+        for resolution, table in sorted(ROLLUP_TABLES.items()):
+            days = self.config['rollup_{minutes}m_days'.format(minutes=resolution // 60)]
+            report[table.__tablename__] = 0
+            if days:
+                report[table.__tablename__] = self.purge(
+                    table, table.id, table.bucket, now - datetime.timedelta(days=days))
+
+        self.last_report = {
+            'time': now,
+            'duration': time.monotonic() - started,
+            'deleted': report,
+        }
+        self.logger.info('Retention deleted {report}'.format(report=report))
+        return report
+
+    def purge(self, table, id_column, time_column, cutoff):
+        deleted = 0
+        while True:
+            ids = [row[0] for row in self.db.session.query(id_column)
+                   .filter(time_column < cutoff)
+                   .order_by(id_column)
+                   .limit(self.config['chunk_size'])]
+            if not ids:
+                break
+            deleted += self.delete_chunk(table, id_column, ids)
+        return deleted
+
+    def purge_raw(self, cutoff):
+        # Aligned to the coarsest rollup, so a bucket is always deleted within one run
+        cutoff = bucket_start(cutoff, max(ROLLUP_TABLES))
+        if self.config['rollups_since'] is None:
+            legacy_cutoff = None
+        else:
+            legacy_cutoff = datetime.datetime(1970, 1, 1) + datetime.timedelta(
+                milliseconds=self.config['rollups_since'])
+        deleted = 0
+        while True:
+            rows = self.db.session.query(LogData.id, LogData.pen_id, LogData.timestamp, LogData.value) \
+                .filter(LogData.timestamp < cutoff) \
+                .order_by(LogData.id) \
+                .limit(self.config['chunk_size']) \
+                .all()
+            if not rows:
+                break
+
+            # Samples recorded before rollups existed are not in the rollups yet
+            if legacy_cutoff is not None:
+                legacy_rows = [{'pen_id': row.pen_id, 'timestamp': row.timestamp, 'value': row.value}
+                               for row in rows if row.timestamp < legacy_cutoff]
+                if legacy_rows:
+                    update_rollups(self.db.session, legacy_rows)
+
+            deleted += self.delete_chunk(LogData, LogData.id, [row.id for row in rows])
+        return deleted
+
+    def delete_chunk(self, table, id_column, ids):
+        count = self.db.session.query(table).filter(id_column.in_(ids)).delete(synchronize_session=False)
+        self.db.session.commit()
+        time.sleep(self.config['chunk_pause'])
+        return count
+
+
+class RetentionWorker(Thread):
+    """
+    Runs the retention policy every config['interval'] seconds
+    """
+    def __init__(self, app, retention):
+        super().__init__(name='RetentionWorker', daemon=True)
+        self.logger = logging.getLogger(__name__)
+        self.app = app
+        self.retention = retention
+        self._stop_event = threading.Event()
+
+    def run(self):
+        with self.app.app_context():
+            while not self._stop_event.wait(self.retention.config['interval']):
+                try:
+                    self.retention.run()
+                except Exception:
+                    self.logger.exception('Applying retention failed')
+                    self.retention.db.session.rollback()
+
+    def stop(self):
+        self._stop_event.set()
+        if self.is_alive():
+            self.join()
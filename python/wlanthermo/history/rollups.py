@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+import datetime
+from sqlalchemy import func
+from sqlalchemy.dialects import mysql
+from wlanthermo.database.tables import *
+
+__author__ = 'Björn Schrader <wlanthermo@bjoern-schrader.de>'
+__license__ = 'GNU General Public License http://www.gnu.org/licenses/gpl.html'
+__copyright__ = 'Copyright (C) 2017 by WLANThermo Project - Released under terms of the GPLv3 License'
+
+# Rollup tables by resolution in seconds
+ROLLUP_TABLES = {
+    LogRollupMinute.resolution: LogRollupMinute,
+    LogRollup10Minutes.resolution: LogRollup10Minutes,
+}
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def bucket_start(timestamp, resolution):
+    """
+    Returns the start of the bucket of the given resolution (seconds) containing timestamp
+
+    >>> bucket_start(datetime.datetime(2017, 5, 1, 12, 34, 56, 789), 600)
+    datetime.datetime(2017, 5, 1, 12, 30)
+    """
+    seconds = int((timestamp - _EPOCH).total_seconds())
+    return _EPOCH + datetime.timedelta(seconds=seconds - seconds % resolution)
+
+
+def aggregate(rows, resolution):
+    """
+    Aggregates log_data rows (dicts with pen_id, timestamp and value) per pen and bucket
+    Returns a list of dicts with pen_id, bucket, min, max, sum and count
+    """
+    buckets = dict()
+    for row in rows:
+        if row['value'] is None:
+            continue
+        key = (row['pen_id'], bucket_start(row['timestamp'], resolution))
+        try:
+            bucket = buckets[key]
+        except KeyError:
+            buckets[key] = {
+                'pen_id': key[0],
+                'bucket': key[1],
+                'min': row['value'],
+                'max': row['value'],
+                'sum': row['value'],
+                'count': 1,
+            }
+        else:
+            bucket['min'] = min(bucket['min'], row['value'])
+            bucket['max'] = max(bucket['max'], row['value'])
+            bucket['sum'] += row['value']
+            bucket['count'] += 1
+    return list(buckets.values())
+
+
+def merge_rollups(session, table, buckets):
+    """
+    Adds aggregated buckets to the rollup table, merging them with existing rows
+    """
+    if not buckets:
+        return
+    if session.get_bind().dialect.name == 'mysql':
+        statement = mysql.insert(table.__table__).values(buckets)
+        statement = statement.on_duplicate_key_update(
+            min=func.least(table.__table__.c.min, statement.inserted.min),
+            max=func.greatest(table.__table__.c.max, statement.inserted.max),
+            sum=table.__table__.c.sum + statement.inserted.sum,
+            count=table.__table__.c.count + statement.inserted.count,
+        )
+        session.execute(statement)
+    else:
+        # One query per bucket, only used by databases without upsert support in here
+        for bucket in buckets:
+            row = session.query(table).filter_by(pen_id=bucket['pen_id'], bucket=bucket['bucket']).one_or_none()
+            if row is None:
+                session.add(table(**bucket))
+            else:
+                row.min = min(row.min, bucket['min'])
+                row.max = max(row.max, bucket['max'])
+                row.sum += bucket['sum']
+                row.count += bucket['count']
+        session.flush()
+
+
+def update_rollups(session, rows):
+    """
+    Adds freshly written log_data rows to all rollup tables, within the caller's transaction
+    """
+    for resolution, table in ROLLUP_TABLES.items():
+        merge_rollups(session, table, aggregate(rows, resolution))
@@ -17,9 +17,12 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from collections import namedtuple
+import enum
 import logging
 from wlanthermo.database.tables import *
 from flask import jsonify, request
+from .scheduler import *
+from .codec import *
 
 __author__ = 'Björn Schrader <wlanthermo@bjoern-schrader.de>'
 __license__ = 'GNU General Public License http://www.gnu.org/licenses/gpl.html'
@@ -42,7 +45,7 @@ class UnknownSpiModeError(Exception):
     pass
 
 
-class ResultState(Enum):
+class ResultState(enum.Enum):
     OK = 1
     NONE = 2
     ERR_LO = 3
@@ -77,6 +80,8 @@ class Modules():
         self.app = wlanthermo.app
         self.db = wlanthermo.db
         self.logger = logging.getLogger(__name__)
+        # sensor_types by module id, filled on registration or first use
+        self.sensor_types = dict()
 
     def register_api(self):
         self.app.add_url_rule('/api/modules/<int:module_id>',
@@ -109,10 +114,13 @@ class Modules():
             self.logger.debug('Found module "{module}" with id {module_id}'.format(
                 module=name,
                 module_id=module.id))
+            if module.sensor_types != sensor_types:
+                self.wlanthermo.sensors.invalidate_module(module.id)
             module.sensor_types = sensor_types
             module.last_seen = datetime.datetime.utcnow()
             self.db.session.commit()
 
+        self.sensor_types[module.id] = sensor_types
         return module.id
 
 
@@ -139,9 +147,10 @@ class Modules():
 
 
     def get_sensors(self, module_id):
-        module = self.db.session.query(ModulesTable).filter(ModulesTable.id == module_id).first()
-        sensors = []
-        for sensor_type in module.sensor_types:
-            sensors.extend(self.wlanthermo.sensors.by_type(sensor_type).keys())
-        return sensors
+        try:
+            sensor_types = self.sensor_types[module_id]
+        except KeyError:
+            module = self.db.session.query(ModulesTable).filter(ModulesTable.id == module_id).first()
+            sensor_types = self.sensor_types[module_id] = module.sensor_types
+        return self.wlanthermo.sensors.by_module(module_id, sensor_types)
 
@@ -0,0 +1,167 @@
+#!/usr/bin/python3
+# coding=utf-8
+
+# Copyright (c) 2017 Björn Schrader
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import math
+import struct
+from collections import namedtuple
+
+__author__ = 'Björn Schrader <wlanthermo@bjoern-schrader.de>'
+__license__ = 'GNU General Public License http://www.gnu.org/licenses/gpl.html'
+__copyright__ = 'Copyright (C) 2017 by WLANThermo Project - Released under terms of the GPLv3 License'
+
+# Results of all channels of a module cycle, binary payload
+MODULE_TOPIC = 'set/module/{module_id}/'
+# Result of one channel, JSON payload
+CHANNEL_TOPIC = 'set/channel/{module_id}/{channel_id}/'
+
+PAYLOAD_VERSION = 1
+# Version, module id, timestamp, channel count, unit count
+_HEADER = struct.Struct('>BHdBB')
+# Channel, state, unit index, value (NaN for None)
+_CHANNEL = struct.Struct('>BBBf')
+_NO_UNIT = 0xff
+
+ModuleCycle = namedtuple('ModuleCycle', ('module', 'timestamp', 'results'))
+
+
+class PayloadError(Exception):
+    pass
+
+
+def encode_cycle(module_id, timestamp, results):
+    """
+    Packs the ChannelResults of one module cycle into a binary payload
+
+    Layout (big endian): header version (B), module id (H), timestamp in
+    seconds since the epoch (d), channel count (B), unit count (B), then
+    per channel: channel (B), ResultState value (B), index into the unit
+    table (B, 0xff for none), value (float32, NaN for none), then the
+    unit table: length (B) and UTF-8 name of every unit.
+    """
+    units = []
+    channels = []
+    for result in results:
+        if result.unit is None:
+            unit_index = _NO_UNIT
+        else:
+            try:
+                unit_index = units.index(result.unit)
+            except ValueError:
+                unit_index = len(units)
+                units.append(result.unit)
+        channels.append(_CHANNEL.pack(
+            result.channel,
+            result.state.value,
+            unit_index,
+            math.nan if result.value is None else result.value,
+        ))
+
+    payload = [_HEADER.pack(PAYLOAD_VERSION, module_id, timestamp, len(channels), len(units))]
+    payload.extend(channels)
+    for unit in units:
+        name = unit.encode('utf-8')
+        payload.append(struct.pack('>B', len(name)) + name)
+    return b''.join(payload)
+
+
+def decode_cycle(payload):
+    """
+    Unpacks a payload of encode_cycle into a ModuleCycle
+
+    >>> from wlanthermo.modules import ChannelResult, ResultState
+    >>> payload = encode_cycle(1, 1500000000.0, [
+    ...     ChannelResult(module=1, channel=0, state=ResultState.OK, value=21.5, unit='temp_celsius'),
+    ...     ChannelResult(module=1, channel=1, state=ResultState.ERR_LO, value=None, unit=None)])
+    >>> len(payload)
+    40
+    >>> decode_cycle(payload).results[1]
+    ChannelResult(module=1, channel=1, state=<ResultState.ERR_LO: 3>, value=None, unit=None)
+    """
+    # Imported here, the package imports this module
+    from wlanthermo.modules import ChannelResult, ResultState
+
+    try:
+        version, module_id, timestamp, channel_count, unit_count = _HEADER.unpack_from(payload)
+        if version != PAYLOAD_VERSION:
+            raise PayloadError('Unsupported payload version {version}'.format(version=version))
+        if not math.isfinite(timestamp):
+            raise PayloadError('Invalid timestamp {timestamp!r}'.format(timestamp=timestamp))
+        offset = _HEADER.size
+        channels = []
+        for index in range(channel_count):
+            channels.append(_CHANNEL.unpack_from(payload, offset))
+            offset += _CHANNEL.size
+        units = []
+        for index in range(unit_count):
+            length = payload[offset]
+            units.append(bytes(payload[offset + 1:offset + 1 + length]).decode('utf-8'))
+            offset += 1 + length
+
+        results = [ChannelResult(
+            module=module_id,
+            channel=channel,
+            state=ResultState(state),
+            value=None if math.isnan(value) else value,
+            unit=None if unit_index == _NO_UNIT else units[unit_index],
+        ) for channel, state, unit_index, value in channels]
+    except (struct.error, IndexError, ValueError) as e:
+        raise PayloadError('Invalid payload: {error}'.format(error=e))
+    return ModuleCycle(module=module_id, timestamp=timestamp, results=results)
+
+
+def encode_result(timestamp, result):
+    """
+    Returns the JSON payload of a single channel result
+    """
+    return json.dumps(dict(result._asdict(), state=result.state.name, timestamp=timestamp))
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+
+def decode_result(payload):
+    """
+    Returns timestamp and ChannelResult of a payload of encode_result
+
+    >>> decode_result('{"module": 1, "channel": 0, "state": "OK", "value": 21, "unit": null, "timestamp": 1.5e9}')
+    (1500000000.0, ChannelResult(module=1, channel=0, state=<ResultState.OK: 1>, value=21.0, unit=None))
+    """
+    from wlanthermo.modules import ChannelResult, ResultState
+
+    try:
+        message = json.loads(payload)
+        timestamp = message['timestamp']
+        value = message['value']
+        if not _is_number(timestamp):
+            raise PayloadError('Invalid timestamp {timestamp!r}'.format(timestamp=timestamp))
+        if value is not None and not _is_number(value):
+            raise PayloadError('Invalid value {value!r}'.format(value=value))
+        for key in ('module', 'channel'):
+            if not isinstance(message[key], int) or isinstance(message[key], bool):
+                raise PayloadError('Invalid {key} {id!r}'.format(key=key, id=message[key]))
+        return timestamp, ChannelResult(
+            module=message['module'],
+            channel=message['channel'],
+            state=ResultState[message['state']],
+            value=None if value is None else float(value),
+            unit=message['unit'],
+        )
+    except (ValueError, KeyError, TypeError) as e:
+        raise PayloadError('Invalid payload: {error}'.format(error=e))
@@ -18,7 +18,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
-from requests import post, get, put
+from requests import Session
 import logging
 from random import uniform
 import datetime
@@ -35,33 +35,53 @@ def run_fake_module(startapp, stopapp):
     fake_module.run()
 
 class FakeModule:
-    def __init__(self, startapp, runapp):
+    def __init__(self, startapp, runapp, name=__name__, channel_count=8, session=None, api_url=API_URL):
         self.logger = logging.getLogger(__name__)
-        self.module_id = post(API_URL + '/api/modules', data={'name': __name__, 'sensor_types': ['ntc_old', 'rtd_pt']}).json()
+        self.api_url = api_url
+        # One keep-alive connection for all requests of the module
+        self.session = session if session is not None else Session()
+        self.module_id = self.session.post(api_url + '/api/modules', data={
+            'name': name,
+            'sensor_types': ['ntc_old', 'rtd_pt'],
+        }).json()
         self.startapp = startapp
         self.runapp = runapp
-        for channel in range(8):
-            post('{api_url}/api/channels/{module_id}/{channel_id}'.format(
-                api_url=API_URL,
+        for channel in range(channel_count):
+            self.session.post('{api_url}/api/channels/{module_id}/{channel_id}'.format(
+                api_url=api_url,
                 module_id=self.module_id,
                 channel_id=channel + 1
             ), data={'unit': 'temp_celsius'}).json()
-        self.channels = [0 for i in range(8)]
+        self.channels = [0 for i in range(channel_count)]
 
+    def next_values(self):
+        """
+        Random walk of all channels, returns {channel_id: value}
+        """
+        values = dict()
+        for channel, channel_value in enumerate(self.channels):
+            channel_value += uniform(-5.0, 5.0)
+            if channel_value > 300:
+                channel_value = 300.0
+            elif channel_value < -30:
+                channel_value = -30.0
+            self.channels[channel] = channel_value
+            values[channel + 1] = channel_value
+        return values
+
+    def send_cycle(self, timestamp=None):
+        """
+        Sends all channels of a cycle in one request, returns the response
+        """
+        if timestamp is None:
+            timestamp = datetime.datetime.utcnow()
+        return self.session.put('{api_url}/api/channels/{module_id}'.format(
+            api_url=self.api_url,
+            module_id=self.module_id
+        ), json={'timestamp': str(timestamp), 'channels': self.next_values()})
 
     def run(self):
         self.startapp.wait()
         while self.runapp:
-            timestamp = datetime.datetime.utcnow()
-            for channel, channel_value in enumerate(self.channels):
-                channel_value += uniform(-5.0, 5.0)
-                if channel_value > 300:
-                    channel_value = 300.0
-                elif channel_value < -30:
-                    channel_value = -30.0
-                put('{api_url}/api/channels/{module_id}/{channel_id}'.format(
-                    api_url=API_URL,
-                    module_id=self.module_id,
-                    channel_id=channel + 1
-                ), data={'value': channel_value, 'timestamp': timestamp}).json()
+            self.send_cycle().json()
             time.sleep(3)
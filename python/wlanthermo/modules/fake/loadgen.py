@@ -0,0 +1,304 @@
+#!/usr/bin/python3
+# coding=utf-8
+
+# Copyright (c) 2017 Björn Schrader
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Load generator simulating many fake modules against a running server
+
+    python3 -m wlanthermo.modules.fake.loadgen --modules 50 --channels 8 --interval 1 --duration 60
+"""
+
+import argparse
+import json
+import logging
+import math
+import os
+import threading
+import time
+from requests import Session, RequestException
+from wlanthermo.modules.fake import FakeModule, API_URL
+
+__author__ = 'Björn Schrader <wlanthermo@bjoern-schrader.de>'
+__license__ = 'GNU General Public License http://www.gnu.org/licenses/gpl.html'
+__copyright__ = 'Copyright (C) 2017 by WLANThermo Project - Released under terms of the GPLv3 License'
+
+PERCENTILES = (50, 95, 99)
+CYCLE_ENDPOINT = 'PUT /api/channels/<module_id>'
+READ_ENDPOINT = 'GET /api/channels'
+
+
+def percentile(sorted_values, percent):
+    """
+    Nearest-rank percentile of an ascending list
+
+    >>> percentile([1, 2, 3, 4, 5, 6, 7, 8, 9, 10], 95)
+    10
+    >>> percentile([1, 2, 3, 4, 5, 6, 7, 8, 9, 10], 50)
+    5
+    """
+    rank = max(int(math.ceil(percent / 100 * len(sorted_values))), 1)
+    return sorted_values[rank - 1]
+
+
+class LatencyRecorder:
+    """
+    Latencies and errors per endpoint, one recorder per thread so no locking is needed
+
+    The response time of a request counts from when it was due to be sent,
+    so time spent waiting behind a slow server is part of the percentiles
+    (no coordinated omission). The service time counts from the actual send.
+    """
+    def __init__(self):
+        self.latencies = dict()
+        self.service_times = dict()
+        self.errors = dict()
+        # Requests sent more than one interval behind their schedule
+        self.late = 0
+
+    def record(self, endpoint, latency, service_time, ok):
+        self.latencies.setdefault(endpoint, []).append(latency)
+        self.service_times.setdefault(endpoint, []).append(service_time)
+        if not ok:
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+    def merge(self, other):
+        for endpoint, latencies in other.latencies.items():
+            self.latencies.setdefault(endpoint, []).extend(latencies)
+        for endpoint, service_times in other.service_times.items():
+            self.service_times.setdefault(endpoint, []).extend(service_times)
+        for endpoint, errors in other.errors.items():
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + errors
+        self.late += other.late
+
+    def report(self, duration, values_per_request=None):
+        """
+        Returns throughput, response and service time percentiles in ms per endpoint
+        """
+        values_per_request = values_per_request or dict()
+        report = dict()
+        for endpoint, latencies in sorted(self.latencies.items()):
+            latencies = sorted(latencies)
+            entry = {
+                'requests': len(latencies),
+                'errors': self.errors.get(endpoint, 0),
+                'requests_per_second': len(latencies) / duration,
+            }
+            if endpoint in values_per_request:
+                entry['values_per_second'] = len(latencies) * values_per_request[endpoint] / duration
+            for percent in PERCENTILES:
+                entry['p{percent}_ms'.format(percent=percent)] = percentile(latencies, percent) * 1000
+            entry['max_ms'] = latencies[-1] * 1000
+            service_times = sorted(self.service_times[endpoint])
+            for percent in PERCENTILES:
+                entry['service_p{percent}_ms'.format(percent=percent)] = percentile(service_times, percent) * 1000
+            entry['service_max_ms'] = service_times[-1] * 1000
+            report[endpoint] = entry
+        return report
+
+
+class ModuleWorker(threading.Thread):
+    """
+    Sends the cycles of some fake modules at a fixed rate over one keep-alive session
+
+    Module i of n sends at offset i / n of the interval, so the load is
+    spread evenly. Sends follow the schedule and not the responses, a slow
+    server shows up as response time and late sends instead of lower load.
+    """
+    def __init__(self, modules, interval, start_time, end_time, stop_event):
+        super().__init__(name='LoadModuleWorker', daemon=True)
+        self.modules = modules
+        self.interval = interval
+        self.start_time = start_time
+        self.end_time = end_time
+        self.stop_event = stop_event
+        self.recorder = LatencyRecorder()
+
+    def run(self):
+        tick = 0
+        while True:
+            for offset, module in self.modules:
+                due = self.start_time + tick * self.interval + offset
+                if due >= self.end_time or self.stop_event.wait(max(due - time.monotonic(), 0)):
+                    return
+                if time.monotonic() - due > self.interval:
+                    self.recorder.late += 1
+                started = time.monotonic()
+                try:
+                    ok = module.send_cycle().ok
+                except RequestException:
+                    ok = False
+                finished = time.monotonic()
+                self.recorder.record(CYCLE_ENDPOINT, finished - due, finished - started, ok)
+            tick += 1
+
+
+class ReadWorker(threading.Thread):
+    """
+    Reads all channels like a browser polling the overview page
+    """
+    def __init__(self, api_url, interval, end_time, stop_event):
+        super().__init__(name='LoadReadWorker', daemon=True)
+        self.api_url = api_url
+        self.interval = interval
+        self.end_time = end_time
+        self.stop_event = stop_event
+        self.session = Session()
+        self.recorder = LatencyRecorder()
+
+    def run(self):
+        due = time.monotonic()
+        while due < self.end_time and not self.stop_event.wait(max(due - time.monotonic(), 0)):
+            started = time.monotonic()
+            try:
+                ok = self.session.get(self.api_url + '/api/channels').ok
+            except RequestException:
+                ok = False
+            finished = time.monotonic()
+            self.recorder.record(READ_ENDPOINT, finished - due, finished - started, ok)
+            due += self.interval
+
+
+class LoadGenerator:
+    """
+    Simulates module_count modules with channel_count channels each, every module sends one cycle per interval
+
+    Modules are spread over worker_count threads, each with its own
+    keep-alive session. reader_count threads read all channels every
+    read_interval seconds at the same time.
+    """
+    def __init__(self, api_url=API_URL, module_count=10, channel_count=8, interval=3.0, worker_count=None,
+                 reader_count=0, read_interval=1.0, name='loadgen'):
+        self.logger = logging.getLogger(__name__)
+        self.api_url = api_url
+        self.module_count = module_count
+        self.channel_count = channel_count
+        self.interval = interval
+        self.worker_count = min(worker_count or os.cpu_count() * 4, module_count)
+        self.reader_count = reader_count
+        self.read_interval = read_interval
+        self.name = name
+        self.sessions = [Session() for worker in range(self.worker_count)]
+        self.modules = []
+        self.stop_event = threading.Event()
+
+    def register(self):
+        """
+        Registers all modules and their channels, names are reused so repeated runs use the same modules
+        """
+        for index in range(self.module_count):
+            module = FakeModule(
+                None, None,
+                name='{name}.{index}'.format(name=self.name, index=index),
+                channel_count=self.channel_count,
+                session=self.sessions[index % self.worker_count],
+                api_url=self.api_url)
+            self.modules.append(module)
+        self.logger.info('Registered {count} modules with {channels} channels each'.format(
+            count=self.module_count,
+            channels=self.channel_count))
+
+    def run(self, duration):
+        """
+        Generates load for duration seconds, returns the report
+        """
+        if not self.modules:
+            self.register()
+        start_time = time.monotonic() + 0.1
+        end_time = start_time + duration
+
+        assignments = [[] for worker in range(self.worker_count)]
+        for index, module in enumerate(self.modules):
+            assignments[index % self.worker_count].append((index * self.interval / self.module_count, module))
+        workers = [ModuleWorker(modules, self.interval, start_time, end_time, self.stop_event)
+                   for modules in assignments]
+        workers.extend(ReadWorker(self.api_url, self.read_interval, end_time, self.stop_event)
+                       for reader in range(self.reader_count))
+        for worker in workers:
+            worker.start()
+        try:
+            for worker in workers:
+                worker.join()
+        except KeyboardInterrupt:
+            self.stop_event.set()
+            for worker in workers:
+                worker.join()
+        elapsed = min(time.monotonic(), end_time) - start_time
+
+        recorder = LatencyRecorder()
+        for worker in workers:
+            recorder.merge(worker.recorder)
+        return {
+            'modules': self.module_count,
+            'channels': self.channel_count,
+            'interval': self.interval,
+            'duration': elapsed,
+            'late_requests': recorder.late,
+            'endpoints': recorder.report(elapsed, {CYCLE_ENDPOINT: self.channel_count}),
+        }
+
+
+def print_report(report):
+    print('{modules} modules x {channels} channels every {interval} s for {duration:.1f} s, '
+          '{late} requests sent late'.format(late=report['late_requests'], **report))
+    for endpoint, entry in report['endpoints'].items():
+        print('{endpoint}: {requests} requests ({errors} errors), {requests_per_second:.1f} req/s'.format(
+            endpoint=endpoint, **entry))
+        print('  response time p50 {p50_ms:.1f} ms, p95 {p95_ms:.1f} ms, p99 {p99_ms:.1f} ms, '
+              'max {max_ms:.1f} ms'.format(**entry))
+        print('  service time p50 {service_p50_ms:.1f} ms, p95 {service_p95_ms:.1f} ms, p99 {service_p99_ms:.1f} ms, '
+              'max {service_max_ms:.1f} ms'.format(**entry))
+        if 'values_per_second' in entry:
+            print('  {values_per_second:.1f} channel values/s'.format(**entry))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Simulates many modules sending channel values to WLANThermo')
+    parser.add_argument('--url', default=API_URL, help='Server URL (default: %(default)s)')
+    parser.add_argument('--modules', type=int, default=10, help='Number of modules (default: %(default)s)')
+    parser.add_argument('--channels', type=int, default=8, help='Channels per module (default: %(default)s)')
+    parser.add_argument('--interval', type=float, default=3.0,
+                        help='Seconds between the cycles of a module (default: %(default)s)')
+    parser.add_argument('--duration', type=float, default=30.0, help='Seconds of load (default: %(default)s)')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Sending threads, each with one keep-alive connection (default: 4 per CPU)')
+    parser.add_argument('--readers', type=int, default=0,
+                        help='Threads reading all channels at the same time (default: %(default)s)')
+    parser.add_argument('--read-interval', type=float, default=1.0,
+                        help='Seconds between the reads of a reader (default: %(default)s)')
+    parser.add_argument('--name', default='loadgen', help='Prefix of the module names (default: %(default)s)')
+    parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    generator = LoadGenerator(
+        api_url=args.url,
+        module_count=args.modules,
+        channel_count=args.channels,
+        interval=args.interval,
+        worker_count=args.workers,
+        reader_count=args.readers,
+        read_interval=args.read_interval,
+        name=args.name)
+    report = generator.run(args.duration)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -18,25 +18,36 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import math
-from struct import pack, unpack
 from wlanthermo.modules import *
 from multiprocessing import Process, Lock, Event
 import logging
 import time
 import json
+from .filters import *
+from .spi import *
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 __author__ = 'Björn Schrader <wlanthermo@bjoern-schrader.de>'
 __license__ = 'GNU General Public License http://www.gnu.org/licenses/gpl.html'
 __copyright__ = 'Copyright (C) 2017 by WLANThermo Project - Released under terms of the GPLv3 License'
 
+# Sensor types sample_all calculates results for
+SUPPORTED_TYPES = ('ntc', 'rtd_pt')
+# Weight of the newest cycle in the noise estimate of adaptive sampling
+NOISE_SMOOTHING = 0.3
+
+
 class Mcp3208:
     def __init__(self, module_id=1):
         self.module_id = module_id
         self.channel_count = 8
         self.channels = range(self.channel_count)
 
-        self.spidev = None
-        self.pi = None
+        self.spi = None
         self.adc_steps = 4096
         self.adc_maxvalue = self.adc_steps - 1
 
@@ -49,12 +60,30 @@ class Mcp3208:
             'spi_mode': 'spidev',
             'hardware_version': 'v2',
             'ref_voltage': 3.3,
+            # Maximum samples per channel and cycle
             'sample_count': 100,
+            # Take fewer samples on quiet channels, so their mean still has a
+            # standard error of accuracy_target ADC codes
+            'adaptive_sampling': True,
+            'accuracy_target': 0.5,
+            'min_sample_count': 10,
             'r_measurement': [
                 47000, 47000, 47000, 47000,
                 47000, 47000, 47000, 47000,
             ],
             'interval': 3,
+            # Ticks missed by an overrunning cycle, 'skip' or 'catch_up'
+            'schedule_policy': 'skip',
+            # Publish results per 'module' cycle (binary), per 'channel' (JSON) or 'both'
+            'publish': 'module',
+            # Filter chain of every channel, see filters.FILTERS
+            'filters': [DEFAULT_FILTERS] * 8,
+            # Use the NumPy pipeline if NumPy is installed
+            'numpy': True,
+            # Run all conversions of a cycle in as few SPI transfers as possible
+            'spi_bulk': True,
+            # Settings of spi_mode 'simulated', see spi.SIMULATION_DEFAULTS
+            'simulation': {},
         }
 
         self.logger = logging.getLogger(__name__)
@@ -67,34 +96,33 @@ class Mcp3208:
             {'type': None}, {'type': None}, {'type': None}, {'type': None},
         ]
 
+        # Result of every ADC code per channel, rebuilt when its sensor or config changes
+        self.lookup_tables = [None] * self.channel_count
+        self.lookup_keys = [None] * self.channel_count
+
+        self.filter_chains = [None] * self.channel_count
+        self.filter_keys = [None] * self.channel_count
+
+        # Smoothed sample variance and sample count of the last cycle per channel
+        self.noise = [None] * self.channel_count
+        self.sample_counts = [0] * self.channel_count
+
+        # Sample buffers, reused every cycle
+        self.sample_lists = [[] for channel in self.channels]
+        self.sample_buffer = None
+        self.sample_order = ((), [])
+        self.sample_order_counts = None
+        if np is not None:
+            self.lookup_array = np.full((self.channel_count, self.adc_steps), np.nan)
+        else:
+            self.lookup_array = None
+
     def init_spi(self):
         """
         Initializes the SPI port 
         """
-        if self.config['spi_mode'] == 'pigpiod':
-            self.logger.info('Initialized in pigpiod mode')
-            import pigpio
-            self.pi = pigpio.pi()
-            try:
-                retval = self.pi.bb_spi_open(
-                    self.config['spi_CS'],
-                    self.config['spi_MISO'],
-                    self.config['spi_MOSI'],
-                    self.config['spi_SCLK'],
-                    250000,
-                    0
-                )
-            except pigpio.error as e:
-                if str(e) == "'GPIO already in use'":
-                    retval = 0
-                else:
-                    raise
-
-        elif self.config['spi_mode'] == 'spidev':
-            self.logger.info('Initialized in spidev mode')
-            import spidev
-            self.spidev = spidev.SpiDev()
-            self.spidev.open(32766, 0)
+        self.spi = open_backend(self.config)
+        self.logger.info('Initialized in {spi_mode} mode'.format(spi_mode=self.config['spi_mode']))
 
     def get_adc(self, channel):
         """
@@ -102,30 +130,47 @@ class Mcp3208:
         """
         if channel > 7:
             raise ValueError()
-        if self.config['spi_mode'] == 'pigpiod':
-            command = pack('>Hx', (0x18 + channel) << 6)
-            return unpack('>xH', self.pi.bb_spi_xfer(self.config['spi_CS'], command)[1])[0] & 0x0fff
-        elif self.config['spi_mode'] == 'spidev':
-            # B0: Start byte, single channel + msb from channel
-            # B1: 2 lsb from channel
-            # B2: fill byte for transfer
-            command = [0x06 | ((channel & 0x04) >> 2), (channel & 0x03) << 6, 0x00]
-            return bytearray_to_int(bytearray(self.spidev.xfer(command))) & 0x0fff
+        return self.spi.read(channel)
+
+    def get_adc_bulk(self, channels):
+        """
+        Converts all given channels in as few SPI transfers as the backend allows
+        Returns the answers of all conversions as one buffer, see decode_adc
+        """
+        return self.spi.transfer(channels)
+
+    def get_sample_order(self, counts):
+        """
+        Returns the channels of all conversions of a cycle and the sample index of each conversion
+        Channels are sampled round by round, each until it has its count of samples
+        """
+        counts = tuple(counts)
+        if self.sample_order_counts != counts:
+            order = []
+            rows = []
+            for sample in range(max(counts)):
+                for channel in self.channels:
+                    if counts[channel] > sample:
+                        order.append(channel)
+                        rows.append(sample)
+            self.sample_order = (tuple(order), rows)
+            self.sample_order_counts = counts
+        return self.sample_order
 
     def get_voltage(self, adc):
         """
         Calculates the voltage measured by an ADC port
         """
-        return adc * self.config['ref_voltage'] / self.config['adc_steps']
+        return adc * self.config['ref_voltage'] / self.adc_steps
 
     def get_resistance(self, adc, r_measurement):
         """
         Calculates the resistance measured by an ADC port
         """
         if not self.config['hardware_version'] == 'v1':
-            adc = self.config['adc_steps'] - 1 - adc
+            adc = self.adc_steps - 1 - adc
 
-        r_sensor = r_measurement * ((self.config['adc_steps'] / adc) - 1)
+        r_sensor = r_measurement * ((self.adc_steps / adc) - 1)
         return r_sensor
 
 
@@ -159,14 +204,14 @@ class Mcp3208:
         r_sensor = self.get_resistance(adc, r_measurement)
 
         try:
-            v = math.log(r_sensor / sensor_conf.r_nominative)
+            v = math.log(r_sensor / sensor_conf['r_nominative'])
             temp = (
                        1 /
                        (
-                           sensor_conf.coeff_a +
-                           sensor_conf.coeff_b * v +
-                           sensor_conf.coeff_c * v ** 2 +
-                           sensor_conf.coeff_d * v ** 3
+                           sensor_conf['coeff_a'] +
+                           sensor_conf['coeff_b'] * v +
+                           sensor_conf['coeff_c'] * v ** 2 +
+                           sensor_conf['coeff_d'] * v ** 3
                        )
                    ) - 273.15
         except:
@@ -183,13 +228,13 @@ class Mcp3208:
         r_sensor = self.get_resistance(adc, r_measurement)
 
         try:
-            v = math.log(r_sensor / sensor_conf.r_nominative)
+            v = math.log(r_sensor / sensor_conf['r_nominative'])
             temp = (
                        1 /
                        (
-                           sensor_conf.coeff_a +
-                           sensor_conf.coeff_b * v +
-                           sensor_conf.coeff_c * v ** 2
+                           sensor_conf['coeff_a'] +
+                           sensor_conf['coeff_b'] * v +
+                           sensor_conf['coeff_c'] * v ** 2
                        )
                    ) - 273.0
         except:
@@ -208,7 +253,7 @@ class Mcp3208:
 
         try:
             temp = -1 * math.sqrt(
-                r_sensor / (sensor_conf.r_nominative * coeff_b) +
+                r_sensor / (sensor_conf['r_nominative'] * coeff_b) +
                 coeff_a ** 2 / (4 * coeff_b ** 2) - 1 / coeff_b
             ) - coeff_a / (2 * coeff_b)
         except:
@@ -222,11 +267,11 @@ class Mcp3208:
         """
         u = self.get_voltage(adc)
         result = (
-            sensor_conf.coeff_a +
-            sensor_conf.coeff_b * u +
-            sensor_conf.coeff_c * u ** 2 +
-            sensor_conf.coeff_d * u ** 3 +
-            sensor_conf.coeff_e * u ** 4
+            sensor_conf['coeff_a'] +
+            sensor_conf['coeff_b'] * u +
+            sensor_conf['coeff_c'] * u ** 2 +
+            sensor_conf['coeff_d'] * u ** 3 +
+            sensor_conf['coeff_e'] * u ** 4
         )
         return result
 
@@ -236,89 +281,270 @@ class Mcp3208:
         """
         r = self.get_resistance(adc, r_measurement)
         result = (
-            sensor_conf.coeff_a +
-            sensor_conf.coeff_b * r +
-            sensor_conf.coeff_c * r ** 2 +
-            sensor_conf.coeff_d * r ** 3 +
-            sensor_conf.coeff_e * r ** 4
+            sensor_conf['coeff_a'] +
+            sensor_conf['coeff_b'] * r +
+            sensor_conf['coeff_c'] * r ** 2 +
+            sensor_conf['coeff_d'] * r ** 3 +
+            sensor_conf['coeff_e'] * r ** 4
         )
         return result
 
-    def median_filter(self, samples):
+    def lookup_key(self, channel):
+        """
+        Returns everything the lookup table of a channel depends on
+        """
+        return (
+            repr(sorted(self.sensors[channel].items())),
+            self.config['r_measurement'][channel],
+            self.config['ref_voltage'],
+            self.config['hardware_version'],
+        )
+
+    def build_lookup_table(self, channel):
+        """
+        Calculates the result of every ADC code for a channel, NaN where there is none
+        """
+        sensor_conf = self.sensors[channel]
+        r_measurement = self.config['r_measurement'][channel]
+        calc_function = getattr(self, 'calc_' + str(sensor_conf['type']))
+
+        table = []
+        for adc in range(self.adc_steps):
+            try:
+                table.append(calc_function(adc, r_measurement, sensor_conf))
+            except (TempCalcError, ArithmeticError, ValueError):
+                table.append(math.nan)
+        return table
+
+    def get_lookup_table(self, channel):
+        key = self.lookup_key(channel)
+        if self.lookup_keys[channel] != key:
+            self.logger.debug('Building lookup table for channel: {channel}'.format(channel=channel))
+            self.lookup_tables[channel] = self.build_lookup_table(channel)
+            self.lookup_keys[channel] = key
+            if self.lookup_array is not None:
+                self.lookup_array[channel] = self.lookup_tables[channel]
+        return self.lookup_tables[channel]
+
+    def lookup(self, table, adc):
+        """
+        Looks up the result of a (fractional) ADC code, interpolating between neighbouring codes
+        NaN if there is no result
+        """
+        index = int(adc)
+        fraction = adc - index
+        if fraction and index < self.adc_maxvalue:
+            result = table[index] + (table[index + 1] - table[index]) * fraction
+        else:
+            result = table[index]
+        return result
+
+    def lookup_all(self, adc_values):
+        """
+        Looks up the (fractional) ADC codes of all channels at once, NaN where there is no result
+        """
+        index = adc_values.astype(np.intp)
+        fraction = adc_values - index
+        upper = np.minimum(index + 1, self.adc_maxvalue)
+        rows = np.arange(self.channel_count)
+        lower_values = self.lookup_array[rows, index]
+        upper_values = self.lookup_array[rows, upper]
+        return np.where(fraction > 0, lower_values + (upper_values - lower_values) * fraction, lower_values)
+
+    def get_filter_chain(self, channel):
+        """
+        Returns the filter chain of a channel, rebuilt with fresh state when its filters or sensor change
         """
-        Implements an averaging median filter
-        Window size is 1 + ln(len(samples))
+        key = (repr(self.config['filters'][channel]), self.lookup_key(channel))
+        if self.filter_keys[channel] != key:
+            try:
+                self.filter_chains[channel] = FilterChain(self.config['filters'][channel])
+            except (UnknownFilterError, KeyError, TypeError) as e:
+                self.logger.error('Invalid filters for channel {channel}, using defaults: {error}'.format(
+                    channel=channel,
+                    error=e))
+                self.filter_chains[channel] = FilterChain()
+            self.filter_keys[channel] = key
+            # The noise of another sensor says nothing about this one
+            self.noise[channel] = None
+        return self.filter_chains[channel]
+
+    def get_sample_counts(self):
         """
-        length = len(samples)
-        sorted_samples = sorted(samples)
+        Returns the number of samples to take of every channel this cycle
 
-        index = int(round(length * 0.5))
+        Channels without a supported sensor are not sampled. With
+        config['adaptive_sampling'] a channel takes as many samples as its
+        noise requires for a standard error of config['accuracy_target']
+        ADC codes, between config['min_sample_count'] and config['sample_count'].
+        """
+        maximum = self.config['sample_count']
+        minimum = min(max(self.config['min_sample_count'], 1), maximum)
+        counts = []
+        for channel in self.channels:
+            if self.sensors[channel]['type'] not in SUPPORTED_TYPES:
+                counts.append(0)
+            elif not self.config['adaptive_sampling'] or self.noise[channel] is None:
+                counts.append(maximum)
+            else:
+                count = math.ceil(self.noise[channel] / self.config['accuracy_target'] ** 2)
+                counts.append(min(max(count, minimum), maximum))
+        return counts
 
-        area_groesse = 1 + int(round(math.log(length)))
-        window_samples = sorted_samples[index - area_groesse:index + area_groesse + 1]
+    def update_noise(self, channel, variance):
+        """
+        Smooths the sample variance of a channel over the last cycles
+        """
+        if self.noise[channel] is None:
+            self.noise[channel] = variance
+        else:
+            self.noise[channel] += NOISE_SMOOTHING * (variance - self.noise[channel])
 
-        return sum(window_samples) / len(window_samples)
+    def get_sampling_report(self):
+        """
+        Returns the sample count of the last cycle and the estimated noise (standard deviation in ADC codes)
+        of every channel
+        """
+        return [{
+            'channel': channel,
+            'sample_count': self.sample_counts[channel],
+            'noise': None if self.noise[channel] is None else math.sqrt(self.noise[channel]),
+        } for channel in self.channels]
+
+    def read_samples(self, counts):
+        """
+        Reads counts[channel] samples of every channel into the reused sample lists
+        """
+        samples = self.sample_lists
+        for channel in self.channels:
+            if len(samples[channel]) != counts[channel]:
+                samples[channel] = [0] * counts[channel]
+        order, rows = self.get_sample_order(counts)
+        if order:
+            codes = decode_adc(self.get_adc_bulk(order))
+            for channel, sample, code in zip(order, rows, codes):
+                samples[channel][sample] = code
+        return samples
+
+    def read_samples_numpy(self, counts):
+        """
+        Reads counts[channel] samples of every channel into the preallocated sample buffer
+        Column channel of the buffer is only valid up to row counts[channel]
+        """
+        shape = (self.config['sample_count'], self.channel_count)
+        if self.sample_buffer is None or self.sample_buffer.shape != shape:
+            self.sample_buffer = np.empty(shape, dtype=np.float64)
+        buffer = self.sample_buffer
+        order, rows = self.get_sample_order(counts)
+        if order:
+            answers = np.frombuffer(self.get_adc_bulk(order), dtype=np.uint8).reshape(-1, CONVERSION_SIZE)
+            buffer[rows, order] = ((answers[:, 1] & 0x0f).astype(np.uint16) << 8) | answers[:, 2]
+        return buffer
+
+    def reduce_samples(self, chains, counts):
+        """
+        Samples all channels and reduces them to one ADC value per channel with the first filter of its chain
+        Returns the values and the sample variances, None for channels without samples
+        """
+        values = [None] * self.channel_count
+        variances = [None] * self.channel_count
+        if np is not None and self.config['numpy']:
+            samples = self.read_samples_numpy(counts)
+            # Channels with equal reducers and sample counts are reduced together
+            groups = dict()
+            for channel in self.channels:
+                if counts[channel]:
+                    groups.setdefault((chains[channel].reducer_key, counts[channel]), []).append(channel)
+            for (reducer_key, count), channels in groups.items():
+                columns = samples[:count, channels]
+                group_variances = columns.var(axis=0)
+                group_values = chains[channels[0]].reducer.reduce_columns(columns)
+                for index, channel in enumerate(channels):
+                    values[channel] = float(group_values[index])
+                    variances[channel] = float(group_variances[index])
+        else:
+            samples = self.read_samples(counts)
+            for channel in self.channels:
+                if counts[channel]:
+                    variances[channel] = variance(samples[channel])
+                    values[channel] = chains[channel].reduce(samples[channel])
+        return values, variances
 
     def sample_all(self):
         """
         Samples all channels defined in self.channels
         """
         self.logger.info('Sampling all channels')
-        samples = [[] for channel in self.channels]
+        chains = [self.get_filter_chain(channel) for channel in self.channels]
+        self.sample_counts = self.get_sample_counts()
+        raw_values, variances = self.reduce_samples(chains, self.sample_counts)
+        for channel in self.channels:
+            if self.sample_counts[channel] > 1:
+                self.update_noise(channel, variances[channel])
+
+        # Check limits and smooth, channels without valid reading keep None
+        states = [ResultState.NONE] * self.channel_count
+        adc_values = [None] * self.channel_count
+        tables = [None] * self.channel_count
+        for channel in self.channels:
+            sensor_type = self.sensors[channel]['type']
+            raw_value = raw_values[channel]
+            if sensor_type is None:
+                states[channel] = ResultState.ERR_NOSENSOR
+            elif sensor_type not in SUPPORTED_TYPES:
+                states[channel] = ResultState.ERR_NOSUPPT
+            # Check for upper and lower limits
+            elif raw_value < self.config['border']:
+                states[channel] = ResultState.ERR_LO
+                chains[channel].reset()
+            elif raw_value > self.adc_maxvalue - self.config['border']:
+                states[channel] = ResultState.ERR_HI
+                chains[channel].reset()
+            else:
+                try:
+                    tables[channel] = self.get_lookup_table(channel)
+                except AttributeError:
+                    states[channel] = ResultState.ERR
+                    self.logger.error(
+                        'Sensor type {sensor_type} is unknown for channel: {channel}'.format(
+                            sensor_type=sensor_type,
+                            channel=channel))
+                else:
+                    adc_values[channel] = chains[channel].smooth(raw_value)
 
-        # Sample all channels
-        for sample in range(self.config['sample_count']):
-            for channnel in self.channels:
-                samples[channnel].append(self.get_adc(channnel))
+        # Calculate results
+        if np is not None and self.config['numpy']:
+            values = self.lookup_all(np.array([0.0 if adc is None else adc for adc in adc_values])).tolist()
+        else:
+            values = [None if adc is None else self.lookup(tables[channel], adc)
+                      for channel, adc in enumerate(adc_values)]
 
-        # Calculate resulting median values
         results = []
-
         for channel in self.channels:
             sensor_conf = self.sensors[channel]
-            r_measurement = self.config['r_measurement'][channel]
-
-            result_state = ResultState.NONE
+            result_state = states[channel]
             result_value = None
             result_unit = None
 
-            if sensor_conf['type'] is None:
-                result_state = ResultState.ERR_NOSENSOR
-            else:
-                median_value = self.median_filter(samples[channel])
-                # Calculate sensor results
-                if sensor_conf['type'] in ('ntc', 'rtd_pt'):
-                    # Check for upper and lower limits
-                    if median_value < self.config['border']:
-                        result_state = ResultState.ERR_LO
-                    elif median_value > self.adc_maxvalue - self.config['border']:
-                        result_state = ResultState.ERR_HI
-                    else:
-                        # Calculate results
-                        try:
-                            calc_function = getattr(self, 'calc_' + str(sensor_conf['type']))
-                            result_value = calc_function(median_value, r_measurement, sensor_conf)
-                            result_state = ResultState.OK
-                            result_unit = sensor_conf['unit']
-                        except TempCalcError:
-                            result_state = ResultState.ERR
-                            self.logger.error(
-                                'Calculating result failed for channel: {channel}'.format(channel=channel))
-                        except AttributeError:
-                            result_state = ResultState.ERR
-                            self.logger.error(
-                                'Sensor type {sensor_type} is unknown for channel: {channel}'.format(
-                                    sensor_type=sensor_conf['type'],
-                                    channel=channel))
+            if adc_values[channel] is not None:
+                if math.isnan(values[channel]):
+                    result_state = ResultState.ERR
+                    self.logger.error(
+                        'Calculating result failed for channel: {channel}'.format(channel=channel))
                 else:
-                    result_state = ResultState.ERR_NOSUPPT
-
-                self.logger.debug('Channel {channel}: state {state}, value: {value} {unit}, raw: {raw}'.format(
-                    state=result_state.name,
-                    channel=channel,
-                    value=result_value,
-                    unit=result_unit,
-                    raw=median_value,
+                    result_value = values[channel]
+                    result_state = ResultState.OK
+                    result_unit = sensor_conf['unit']
+
+            if sensor_conf['type'] is not None:
+                self.logger.debug(
+                    'Channel {channel}: state {state}, value: {value} {unit}, raw: {raw}, samples: {count}'.format(
+                        state=result_state.name,
+                        channel=channel,
+                        value=result_value,
+                        unit=result_unit,
+                        raw=raw_values[channel],
+                        count=self.sample_counts[channel],
                     ))
 
             result = ChannelResult(
@@ -340,6 +566,9 @@ class Mcp3208Process():
 
         self.module_id = module_id
         self.mcp3208 = Mcp3208(module_id)
+        self.scheduler = FixedRateScheduler(
+            self.mcp3208.config['interval'],
+            self.mcp3208.config['schedule_policy'])
 
     def start(self):
         self.register_module()
@@ -358,22 +587,41 @@ class Mcp3208Process():
 
     def terminate(self):
         self.stop = True
+        self.scheduler.stop()
 
     def register_module(self):
         pass
 
     def loop(self):
-        while not self.stop:
-            start_time = time.time()
-            with self.config_mcp3208_lock:
-                for result in self.mcp3208.sample_all():
-                    self.mqtt_client.publish('set/channel/{module_id}/{channel_id}/'.format(
-                        module_id=result.module,
-                        channel_id=result.channel
-                    ), payload=json.dumps(result), qos=0, retain=False)
+        while not self.stop and self.scheduler.wait():
+            timestamp = self.scheduler.timestamp
             with self.config_mcp3208_lock:
-                loop_wait = self.mcp3208.config['interval'] - (time.time() - start_time)
-            time.sleep(loop_wait)
+                results = self.mcp3208.sample_all()
+                self.scheduler.set_interval(self.mcp3208.config['interval'])
+                self.scheduler.set_policy(self.mcp3208.config['schedule_policy'])
+            self.publish(timestamp, results)
+
+    def publish(self, timestamp, results):
+        publish = self.mcp3208.config['publish']
+        if publish in ('module', 'both'):
+            self.mqtt_client.publish(
+                MODULE_TOPIC.format(module_id=self.module_id),
+                payload=encode_cycle(self.module_id, timestamp, results), qos=0, retain=False)
+        if publish in ('channel', 'both'):
+            for result in results:
+                self.mqtt_client.publish(CHANNEL_TOPIC.format(
+                    module_id=result.module,
+                    channel_id=result.channel
+                ), payload=encode_result(timestamp, result), qos=0, retain=False)
+
+    def get_statistics(self):
+        """
+        Returns the scheduler statistics and the sample counts of all channels
+        """
+        return {
+            'scheduler': self.scheduler.statistics(),
+            'sampling': self.mcp3208.get_sampling_report(),
+        }
 
     def wait_on_config(self):
         self.config_sensors_received.wait()
@@ -392,7 +640,7 @@ class Mcp3208Process():
         client.subscribe("sensor_config/")
         client.subscribe("config/mcp3208/")
         client.subscribe("command/")
-        if self.config_sensors_received.is_set()
+        if self.config_sensors_received.is_set():
             # In case of lost connection resubscribe
             client.subscribe("channel_config/{module_id}/+/".format(module_id=self.module_id))
 
@@ -402,14 +650,20 @@ class Mcp3208Process():
     def on_config_mcp3208(self, client, userdata, msg):
         self.logger.info('Config config_mcp3208 received')
         with self.config_mcp3208_lock:
+            policy = self.mcp3208.config['schedule_policy']
             self.mcp3208.config.update(json.loads(msg.payload))
+            if self.mcp3208.config['schedule_policy'] not in SCHEDULE_POLICIES:
+                self.logger.error('Unknown schedule policy {policy}, keeping {old_policy}'.format(
+                    policy=self.mcp3208.config['schedule_policy'],
+                    old_policy=policy))
+                self.mcp3208.config['schedule_policy'] = policy
         self.config_mcp3208_received.set()
 
     def on_config_sensors(self, client, userdata, msg):
         self.logger.info('Config config_sensors received')
         with self.config_sensors_lock:
             self.sensors.update(json.loads(msg.payload))
-        if not self.config_sensors_received.is_set()
+        if not self.config_sensors_received.is_set():
             self.logger.info('Config config_sensors for the first time received, subscribing to channel_config')
             self.config_sensors_received.set()
             client.subscribe("channel_config/{module_id}/+/".format(module_id=self.module_id))
@@ -431,7 +685,7 @@ class Mcp3208Process():
         
         if not None in self.mcp3208.sensors:
             # All sensors have been set
-            if not self.config_channels_received.is_set()
+            if not self.config_channels_received.is_set():
                 self.logger.info('Received all required config_channels!')
                 self.config_channels_received.set()
 
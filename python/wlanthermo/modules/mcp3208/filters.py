@@ -0,0 +1,249 @@
+#!/usr/bin/python3
+# coding=utf-8
+
+# Copyright (c) 2017 Björn Schrader
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import math
+
+__author__ = 'Björn Schrader <wlanthermo@bjoern-schrader.de>'
+__license__ = 'GNU General Public License http://www.gnu.org/licenses/gpl.html'
+__copyright__ = 'Copyright (C) 2017 by WLANThermo Project - Released under terms of the GPLv3 License'
+
+# Filter chain of a channel if none is configured
+DEFAULT_FILTERS = [{'type': 'trimmed_median'}]
+
+
+class UnknownFilterError(Exception):
+    pass
+
+
+def select(samples, k, left=0, right=None):
+    """
+    Moves the k-th smallest sample of samples[left:right] to samples[k], in place
+    Smaller samples end up left of it, larger ones right of it (Hoare's quickselect)
+
+    >>> samples = [5, 1, 4, 2, 3]
+    >>> select(samples, 2)
+    3
+    >>> sorted(samples[:2]), sorted(samples[3:])
+    ([1, 2], [4, 5])
+    """
+    if right is None:
+        right = len(samples)
+    right -= 1
+    while left < right:
+        # Median of three as pivot, so sorted input does not degrade to O(n²)
+        first, middle, last = samples[left], samples[(left + right) // 2], samples[right]
+        pivot = max(min(first, middle), min(max(first, middle), last))
+        i, j = left, right
+        while i <= j:
+            while samples[i] < pivot:
+                i += 1
+            while samples[j] > pivot:
+                j -= 1
+            if i <= j:
+                samples[i], samples[j] = samples[j], samples[i]
+                i += 1
+                j -= 1
+        if k <= j:
+            right = j
+        elif k >= i:
+            left = i
+        else:
+            break
+    return samples[k]
+
+
+def window_mean(samples, start, end):
+    """
+    Mean of the samples which would be at start:end if samples were sorted, reorders samples
+
+    >>> window_mean([9, 1, 8, 2, 7, 3], 2, 4)
+    5.0
+    """
+    select(samples, start)
+    if end - start > 1:
+        select(samples, end - 1, start + 1)
+    total = 0
+    for index in range(start, end):
+        total += samples[index]
+    return total / (end - start)
+
+
+def variance(samples):
+    """
+    Population variance of samples, without copying them
+
+    >>> variance([1, 2, 3, 4])
+    1.25
+    """
+    length = len(samples)
+    total = 0
+    for sample in samples:
+        total += sample
+    mean = total / length
+    squares = 0
+    for sample in samples:
+        squares += (sample - mean) ** 2
+    return squares / length
+
+
+class SampleFilter:
+    """
+    Base of all filters
+
+    reduce() turns the samples of one cycle into one value and must not keep
+    state, update() smooths the values of consecutive cycles. The first
+    filter of a channel reduces, then all filters update in order.
+    """
+    def __init__(self, **options):
+        self.options = options
+
+    def reduce(self, samples):
+        total = 0
+        for sample in samples:
+            total += sample
+        return total / len(samples)
+
+    def reduce_columns(self, samples):
+        """
+        Reduces all columns of a (sample_count, channel_count) NumPy array
+        """
+        return samples.mean(axis=0)
+
+    def update(self, value):
+        return value
+
+    def reset(self):
+        pass
+
+
+class TrimmedMedianFilter(SampleFilter):
+    """
+    Mean of a window of 1 + ln(n) samples on both sides of the median
+    """
+    def window(self, length):
+        index = int(round(length * 0.5))
+        area = 1 + int(round(math.log(length)))
+        return max(index - area, 0), min(index + area + 1, length)
+
+    def reduce(self, samples):
+        start, end = self.window(len(samples))
+        return window_mean(samples, start, end)
+
+    def reduce_columns(self, samples):
+        start, end = self.window(samples.shape[0])
+        samples.partition(range(start, end), axis=0)
+        return samples[start:end].mean(axis=0)
+
+
+class TrimmedMeanFilter(TrimmedMedianFilter):
+    """
+    Mean of the samples without the lowest and highest options['trim'] share
+    """
+    def window(self, length):
+        cut = int(length * self.options.get('trim', 0.1))
+        return min(cut, (length - 1) // 2), max(length - cut, length // 2 + 1)
+
+
+class EmaFilter(SampleFilter):
+    """
+    Exponential moving average across cycles with smoothing factor options['alpha']
+    """
+    def __init__(self, **options):
+        super().__init__(**options)
+        self.alpha = options.get('alpha', 0.3)
+        self.value = None
+
+    def update(self, value):
+        if self.value is None:
+            self.value = value
+        else:
+            self.value += self.alpha * (value - self.value)
+        return self.value
+
+    def reset(self):
+        self.value = None
+
+
+class KalmanFilter(SampleFilter):
+    """
+    One-dimensional Kalman filter for a slowly drifting value
+
+    options['process_noise'] is the expected variance of the drift per cycle,
+    options['measurement_noise'] the variance of a single reading.
+    """
+    def __init__(self, **options):
+        super().__init__(**options)
+        self.process_noise = options.get('process_noise', 0.05)
+        self.measurement_noise = options.get('measurement_noise', 1.0)
+        self.value = None
+        self.error = None
+
+    def update(self, value):
+        if self.value is None:
+            self.value = value
+            self.error = self.measurement_noise
+        else:
+            self.error += self.process_noise
+            gain = self.error / (self.error + self.measurement_noise)
+            self.value += gain * (value - self.value)
+            self.error *= 1 - gain
+        return self.value
+
+    def reset(self):
+        self.value = None
+        self.error = None
+
+
+FILTERS = {
+    'trimmed_median': TrimmedMedianFilter,
+    'trimmed_mean': TrimmedMeanFilter,
+    'ema': EmaFilter,
+    'kalman': KalmanFilter,
+}
+
+
+class FilterChain:
+    """
+    Filters of one channel, built from a list of {'type': ..., option: value} dicts
+    """
+    def __init__(self, config=DEFAULT_FILTERS):
+        if not config:
+            config = DEFAULT_FILTERS
+        self.filters = []
+        for filter_config in config:
+            options = dict(filter_config)
+            filter_type = options.pop('type')
+            try:
+                self.filters.append(FILTERS[filter_type](**options))
+            except KeyError:
+                raise UnknownFilterError('Filter type {filter_type} is unknown'.format(filter_type=filter_type))
+        self.reducer = self.filters[0]
+        # Channels with equal reducers share one NumPy reduction
+        self.reducer_key = repr(config[0])
+
+    def reduce(self, samples):
+        return self.reducer.reduce(samples)
+
+    def smooth(self, value):
+        for sample_filter in self.filters:
+            value = sample_filter.update(value)
+        return value
+
+    def reset(self):
+        for sample_filter in self.filters:
+            sample_filter.reset()
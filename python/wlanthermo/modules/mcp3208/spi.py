@@ -0,0 +1,284 @@
+#!/usr/bin/python3
+# coding=utf-8
+
+# Copyright (c) 2017 Björn Schrader
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import ctypes
+import fcntl
+import logging
+import random
+import time
+from struct import pack
+from wlanthermo.modules import UnknownSpiModeError
+
+__author__ = 'Björn Schrader <wlanthermo@bjoern-schrader.de>'
+__license__ = 'GNU General Public License http://www.gnu.org/licenses/gpl.html'
+__copyright__ = 'Copyright (C) 2017 by WLANThermo Project - Released under terms of the GPLv3 License'
+
+# Bytes of one MCP3208 conversion, command and answer
+CONVERSION_SIZE = 3
+# The size field of the ioctl request limits one message to 511 transfers
+SPI_MAX_TRANSFERS = 511
+# Settings of the simulated backend
+SIMULATION_DEFAULTS = {
+    # ADC code per channel
+    'codes': [2048, 2048, 2048, 2048, 2048, 2048, 2048, 2048],
+    # Standard deviation of the gaussian noise in ADC codes
+    'noise': 2.0,
+    # Seconds per transfer and per conversion
+    'latency': 0.0,
+    'conversion_time': 0.0,
+    # File with one line of comma separated codes of all channels per sample, replayed instead of codes
+    'recording': None,
+    'seed': None,
+}
+
+
+def adc_command(channel):
+    """
+    Returns the command of a single ended conversion of channel
+    B0: Start byte, single channel + msb from channel
+    B1: 2 lsb from channel
+    B2: fill byte for transfer
+
+    >>> adc_command(5)
+    b'\\x07@\\x00'
+    """
+    return bytes((0x06 | ((channel & 0x04) >> 2), (channel & 0x03) << 6, 0x00))
+
+
+def decode_adc(buffer):
+    """
+    Returns the ADC codes contained in a buffer of conversion answers
+
+    >>> decode_adc(b'\\xff\\xf8\\x00\\x00\\x01\\x23')
+    [2048, 291]
+    """
+    return [((buffer[index + 1] & 0x0f) << 8) | buffer[index + 2]
+            for index in range(0, len(buffer), CONVERSION_SIZE)]
+
+
+class SpiIocTransfer(ctypes.Structure):
+    """
+    struct spi_ioc_transfer from linux/spi/spidev.h
+    """
+    _fields_ = [
+        ('tx_buf', ctypes.c_uint64),
+        ('rx_buf', ctypes.c_uint64),
+        ('len', ctypes.c_uint32),
+        ('speed_hz', ctypes.c_uint32),
+        ('delay_usecs', ctypes.c_uint16),
+        ('bits_per_word', ctypes.c_uint8),
+        ('cs_change', ctypes.c_uint8),
+        ('tx_nbits', ctypes.c_uint8),
+        ('rx_nbits', ctypes.c_uint8),
+        ('word_delay_usecs', ctypes.c_uint8),
+        ('pad', ctypes.c_uint8),
+    ]
+
+
+def spi_ioc_message(count):
+    """
+    Returns the ioctl request SPI_IOC_MESSAGE(count)
+    """
+    return (1 << 30) | ((count * ctypes.sizeof(SpiIocTransfer)) << 16) | (ord('k') << 8)
+
+
+class SpiBulkMessage:
+    """
+    Many conversions sent to a spidev device with one ioctl per SPI_MAX_TRANSFERS
+
+    Every conversion is a transfer of its own with chip select toggled in
+    between, as the MCP3208 starts a conversion on the falling edge of CS.
+    Buffers and transfer descriptions are built once and reused.
+    """
+    def __init__(self, channels):
+        self.channels = tuple(channels)
+        commands = b''.join(adc_command(channel) for channel in self.channels)
+        self.tx = ctypes.create_string_buffer(commands, len(commands))
+        self.rx = ctypes.create_string_buffer(len(commands))
+
+        self.messages = []
+        tx_address = ctypes.addressof(self.tx)
+        rx_address = ctypes.addressof(self.rx)
+        for first in range(0, len(self.channels), SPI_MAX_TRANSFERS):
+            count = min(SPI_MAX_TRANSFERS, len(self.channels) - first)
+            transfers = (SpiIocTransfer * count)()
+            for index, transfer in enumerate(transfers):
+                offset = (first + index) * CONVERSION_SIZE
+                transfer.tx_buf = tx_address + offset
+                transfer.rx_buf = rx_address + offset
+                transfer.len = CONVERSION_SIZE
+                # Release CS after every conversion but the last of a message
+                transfer.cs_change = 1 if index < count - 1 else 0
+            self.messages.append((spi_ioc_message(count), transfers))
+
+    def transfer(self, fd):
+        """
+        Runs all conversions, returns the answers as one buffer
+        """
+        for request, transfers in self.messages:
+            fcntl.ioctl(fd, request, transfers)
+        return self.rx.raw
+
+
+class SpiBackend:
+    """
+    Base of the SPI drivers
+
+    transfer() runs the conversions of the given channels and returns their
+    answers as one buffer, see decode_adc.
+    """
+    def __init__(self, config):
+        self.logger = logging.getLogger(__name__)
+        self.config = config
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    def read(self, channel):
+        return decode_adc(self.transfer((channel,)))[0]
+
+    def transfer(self, channels):
+        raise NotImplementedError
+
+
+class SpidevBackend(SpiBackend):
+    """
+    Hardware SPI through the spidev kernel driver, bulk transfers if config['spi_bulk'] is set
+    """
+    def __init__(self, config):
+        super().__init__(config)
+        self.spidev = None
+        self.bulk_message = None
+        self.bulk_supported = True
+
+    def open(self):
+        import spidev
+        self.spidev = spidev.SpiDev()
+        self.spidev.open(32766, 0)
+
+    def close(self):
+        self.spidev.close()
+
+    def transfer(self, channels):
+        if self.config['spi_bulk'] and self.bulk_supported:
+            if self.bulk_message is None or self.bulk_message.channels != channels:
+                self.bulk_message = SpiBulkMessage(channels)
+            try:
+                return self.bulk_message.transfer(self.spidev.fileno())
+            except OSError as e:
+                self.logger.warning('Bulk SPI transfers not supported, converting one by one: {error}'.format(
+                    error=e))
+                self.bulk_supported = False
+        return b''.join(bytes(self.spidev.xfer(list(adc_command(channel)))) for channel in channels)
+
+
+class PigpioBackend(SpiBackend):
+    """
+    Bit banged SPI through pigpiod
+
+    There is no call toggling chip select between conversions, so every
+    conversion is a request to pigpiod of its own.
+    """
+    def __init__(self, config):
+        super().__init__(config)
+        self.pi = None
+
+    def open(self):
+        import pigpio
+        self.pi = pigpio.pi()
+        try:
+            self.pi.bb_spi_open(
+                self.config['spi_CS'],
+                self.config['spi_MISO'],
+                self.config['spi_MOSI'],
+                self.config['spi_SCLK'],
+                250000,
+                0
+            )
+        except pigpio.error as e:
+            if str(e) != "'GPIO already in use'":
+                raise
+
+    def close(self):
+        self.pi.bb_spi_close(self.config['spi_CS'])
+        self.pi.stop()
+
+    def transfer(self, channels):
+        return b''.join(bytes(self.pi.bb_spi_xfer(self.config['spi_CS'], adc_command(channel))[1])
+                        for channel in channels)
+
+
+class SimulatedBackend(SpiBackend):
+    """
+    ADC without hardware for benchmarks and tests, settings in config['simulation']
+
+    Returns the configured code of every channel or replays a recording,
+    both with gaussian noise, and sleeps for the configured latency.
+    """
+    def __init__(self, config):
+        super().__init__(config)
+        self.settings = dict(SIMULATION_DEFAULTS)
+        self.settings.update(config.get('simulation', {}))
+        self.random = random.Random(self.settings['seed'])
+        self.recording = None
+        self.positions = [0] * 8
+
+    def open(self):
+        if self.settings['recording']:
+            with open(self.settings['recording']) as recording:
+                self.recording = [[int(code) for code in line.split(',')]
+                                  for line in recording if line.strip()]
+            self.logger.info('Replaying {count} recorded samples'.format(count=len(self.recording)))
+
+    def next_code(self, channel):
+        if self.recording:
+            code = self.recording[self.positions[channel] % len(self.recording)][channel]
+            self.positions[channel] += 1
+        else:
+            code = self.settings['codes'][channel]
+        if self.settings['noise']:
+            code = round(code + self.random.gauss(0, self.settings['noise']))
+        return min(max(code, 0), 0x0fff)
+
+    def transfer(self, channels):
+        delay = self.settings['latency'] + self.settings['conversion_time'] * len(channels)
+        if delay:
+            time.sleep(delay)
+        return b''.join(pack('>xH', self.next_code(channel)) for channel in channels)
+
+
+BACKENDS = {
+    'spidev': SpidevBackend,
+    'pigpiod': PigpioBackend,
+    'simulated': SimulatedBackend,
+}
+
+
+def open_backend(config):
+    """
+    Opens the SPI backend selected by config['spi_mode']
+    """
+    try:
+        backend = BACKENDS[config['spi_mode']](config)
+    except KeyError:
+        raise UnknownSpiModeError('SPI mode {spi_mode} is unknown'.format(spi_mode=config['spi_mode']))
+    backend.open()
+    return backend
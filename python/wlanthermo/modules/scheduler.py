@@ -0,0 +1,155 @@
+#!/usr/bin/python3
+# coding=utf-8
+
+# Copyright (c) 2017 Björn Schrader
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import math
+import threading
+import time
+
+__author__ = 'Björn Schrader <wlanthermo@bjoern-schrader.de>'
+__license__ = 'GNU General Public License http://www.gnu.org/licenses/gpl.html'
+__copyright__ = 'Copyright (C) 2017 by WLANThermo Project - Released under terms of the GPLv3 License'
+
+# What happens with ticks missed by an overrunning cycle
+SCHEDULE_POLICIES = ('skip', 'catch_up')
+# More missed ticks than this are skipped even with policy catch_up, e.g. after a suspend
+MAX_CATCH_UP = 5
+
+
+class FixedRateScheduler:
+    """
+    Fixed rate ticks on the monotonic clock
+
+    Tick k is due interval seconds after tick k - 1, computed from the first
+    tick, so lateness of one cycle never shifts the following ones. Every
+    tick has a timestamp on a grid of multiples of interval on the wall
+    clock. Wall clock jumps (e.g. NTP setting the clock after boot) move
+    the grid without disturbing the schedule.
+
+        scheduler = FixedRateScheduler(3)
+        while scheduler.wait():
+            publish(scheduler.timestamp, sample())
+    """
+    def __init__(self, interval, policy='skip', clock=time.monotonic, wall_clock=time.time):
+        if policy not in SCHEDULE_POLICIES:
+            raise ValueError('Unknown schedule policy {policy}'.format(policy=policy))
+        self.logger = logging.getLogger(__name__)
+        self.interval = interval
+        self.policy = policy
+        self.clock = clock
+        self.wall_clock = wall_clock
+        self._stop_event = threading.Event()
+
+        self.base = None
+        self.base_timestamp = None
+        self.tick = 0
+        self.timestamp = None
+
+        self.ticks = 0
+        self.overruns = 0
+        self.skipped = 0
+        self.clock_jumps = 0
+        self.jitter_last = 0.0
+        self.jitter_max = 0.0
+        self.jitter_sum = 0.0
+
+    def anchor(self):
+        """
+        Puts the first tick on the next multiple of interval on the wall clock
+        """
+        now, wall = self.clock(), self.wall_clock()
+        self.base_timestamp = math.ceil(wall / self.interval) * self.interval
+        self.base = now + self.base_timestamp - wall
+        self.tick = 0
+
+    def set_interval(self, interval):
+        """
+        Changes the interval, the schedule starts over on the new grid
+        """
+        if interval != self.interval:
+            self.interval = interval
+            self.base = None
+
+    def set_policy(self, policy):
+        """
+        Changes how overruns are handled from the next tick on
+        """
+        if policy not in SCHEDULE_POLICIES:
+            raise ValueError('Unknown schedule policy {policy}'.format(policy=policy))
+        self.policy = policy
+
+    def deadline(self, tick):
+        return self.base + tick * self.interval
+
+    def wait(self):
+        """
+        Sleeps until the next tick, returns False once stopped
+        """
+        if self.base is None:
+            self.anchor()
+        else:
+            self.tick += 1
+            now = self.clock()
+            if now > self.deadline(self.tick):
+                # The last cycle ran into this tick
+                self.overruns += 1
+                missed = int((now - self.deadline(self.tick)) // self.interval) + 1
+                if self.policy == 'skip' or missed > MAX_CATCH_UP:
+                    self.tick += missed
+                    self.skipped += missed
+                    self.logger.warning('Cycle overran, skipped {missed} tick(s)'.format(missed=missed))
+                else:
+                    self.logger.warning('Cycle overran, catching up {missed} tick(s)'.format(missed=missed))
+
+        deadline = self.deadline(self.tick)
+        if self._stop_event.wait(max(deadline - self.clock(), 0)):
+            return False
+
+        now = self.clock()
+        jitter = now - deadline
+        self.ticks += 1
+        self.jitter_last = jitter
+        self.jitter_max = max(self.jitter_max, jitter)
+        self.jitter_sum += jitter
+
+        # Follow the wall clock if it was set, in whole intervals to stay on the grid
+        offset = self.wall_clock() - (self.base_timestamp + now - self.base)
+        if abs(offset) > max(self.interval / 2, 1):
+            self.clock_jumps += 1
+            self.base_timestamp += round(offset / self.interval) * self.interval
+            self.logger.warning('Wall clock jumped by {offset:.1f} s'.format(offset=offset))
+
+        self.timestamp = self.base_timestamp + self.tick * self.interval
+        return True
+
+    def stop(self):
+        self._stop_event.set()
+
+    def statistics(self):
+        """
+        Returns counters and the lateness of ticks (jitter) in seconds
+        """
+        return {
+            'ticks': self.ticks,
+            'overruns': self.overruns,
+            'skipped': self.skipped,
+            'clock_jumps': self.clock_jumps,
+            'jitter_last': self.jitter_last,
+            'jitter_max': self.jitter_max,
+            'jitter_mean': self.jitter_sum / self.ticks if self.ticks else 0.0,
+        }
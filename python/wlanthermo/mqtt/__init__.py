@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+import logging
+from wlanthermo.modules import MODULE_TOPIC, CHANNEL_TOPIC, PayloadError, ResultState, decode_cycle, decode_result
+from wlanthermo.settings import SystemSettings
+from .broker import *
+from .ingest import *
+
+try:
+    import paho.mqtt.client as paho
+except ImportError:
+    paho = None
+
+__author__ = 'Björn Schrader <wlanthermo@bjoern-schrader.de>'
+__license__ = 'GNU General Public License http://www.gnu.org/licenses/gpl.html'
+__copyright__ = 'Copyright (C) 2017 by WLANThermo Project - Released under terms of the GPLv3 License'
+
+# Defaults of the "mqtt" config scope
+MQTT_DEFAULTS = {
+    'enabled': True,
+    'host': 'localhost',
+    'port': 1883,
+    'keepalive': 60,
+    'cycle_wait': CYCLE_WAIT,
+}
+
+
+def result_value(result):
+    """
+    Value of a ChannelResult as stored in the channel, None unless the reading is valid
+    """
+    return result.value if result.state == ResultState.OK else None
+
+
+class MqttIngest:
+    """
+    Subscribes to the result topics of the modules and feeds them into Channels
+
+    client_factory returns a client with the interface of
+    paho.mqtt.client.Client, e.g. LocalBroker().client for tests. paho is
+    used if it is not given, without paho the ingest stays disabled.
+    """
+    def __init__(self, wlanthermo, client_factory=None):
+        self.wlanthermo = wlanthermo
+        self.app = wlanthermo.app
+        self.logger = logging.getLogger(__name__)
+        self.config = self.get_mqtt_config()
+        if client_factory is None and paho is not None:
+            client_factory = paho.Client
+        self.client_factory = client_factory
+        self.client = None
+        self.invalid = 0
+        self.worker = IngestWorker(self.app, wlanthermo.channels, cycle_wait=self.config['cycle_wait'])
+
+    def get_mqtt_config(self):
+        """
+        Reads scope "mqtt" of the system settings, missing keys are added with their defaults
+        """
+        settings = SystemSettings(self.wlanthermo, 'mqtt')
+        config = dict()
+        missing = dict()
+        for key, default in MQTT_DEFAULTS.items():
+            try:
+                config[key] = settings[key]
+            except KeyError:
+                self.logger.info('MQTT setting "{key}" is missing, using default {default}'.format(
+                    key=key,
+                    default=default))
+                config[key] = missing[key] = default
+        if missing:
+            settings.set(missing)
+        return config
+
+    def start(self):
+        if not self.config['enabled']:
+            self.logger.info('MQTT ingest is disabled')
+            return
+        if self.client_factory is None:
+            self.logger.warning('MQTT ingest needs paho-mqtt, which is not installed')
+            return
+
+        self.worker.start()
+        self.client = self.client_factory()
+        self.client.on_connect = self.on_connect
+        self.client.on_message = self.on_message
+        # Connects in the background and reconnects when the broker was not reachable
+        self.client.connect_async(self.config['host'], self.config['port'], self.config['keepalive'])
+        self.client.loop_start()
+
+    def stop(self):
+        if self.client is not None:
+            self.client.disconnect()
+            self.client.loop_stop()
+            self.client = None
+        self.worker.stop()
+
+    def on_connect(self, client, userdata, flags, rc):
+        self.logger.info('Connected to MQTT broker with result code {rc}'.format(rc=rc))
+        # Subscribed again after every reconnect
+        client.subscribe(MODULE_TOPIC.format(module_id='+'))
+        client.subscribe(CHANNEL_TOPIC.format(module_id='+', channel_id='+'))
+
+    def on_message(self, client, userdata, msg):
+        try:
+            if topic_matches(MODULE_TOPIC.format(module_id='+'), msg.topic):
+                cycle = decode_cycle(msg.payload)
+                values = {result.channel: result_value(result) for result in cycle.results}
+                self.worker.put(cycle.module, cycle.timestamp, values, complete=True)
+            else:
+                timestamp, result = decode_result(msg.payload)
+                self.worker.put(result.module, timestamp, {result.channel: result_value(result)}, complete=False)
+        except PayloadError as e:
+            self.invalid += 1
+            self.logger.warning('Invalid message on topic "{topic}": {error}'.format(topic=msg.topic, error=e))
+
+    def statistics(self):
+        statistics = self.worker.statistics()
+        statistics['invalid'] = self.invalid
+        return statistics
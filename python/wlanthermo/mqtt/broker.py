@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+import logging
+import threading
+from collections import namedtuple
+
+__author__ = 'Björn Schrader <wlanthermo@bjoern-schrader.de>'
+__license__ = 'GNU General Public License http://www.gnu.org/licenses/gpl.html'
+__copyright__ = 'Copyright (C) 2017 by WLANThermo Project - Released under terms of the GPLv3 License'
+
+LocalMessage = namedtuple('LocalMessage', ('topic', 'payload', 'qos', 'retain'))
+
+
+def topic_matches(subscription, topic):
+    """
+    Returns whether topic matches a subscription with MQTT wildcards + and #
+
+    >>> topic_matches('set/channel/+/+/', 'set/channel/1/7/')
+    True
+    >>> topic_matches('set/#', 'set/module/1/')
+    True
+    >>> topic_matches('set/module/+/', 'set/channel/1/7/')
+    False
+    """
+    subscription_levels = subscription.split('/')
+    topic_levels = topic.split('/')
+    for index, level in enumerate(subscription_levels):
+        if level == '#':
+            return True
+        if index >= len(topic_levels) or (level != '+' and level != topic_levels[index]):
+            return False
+    return len(subscription_levels) == len(topic_levels)
+
+
+class LocalBroker:
+    """
+    In-process stand-in for an MQTT broker, for tests and benchmarks without network
+
+    Messages are delivered synchronously in the publishing thread to all
+    matching subscriptions of all clients.
+    """
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+        self._clients = []
+        self._lock = threading.Lock()
+
+    def client(self):
+        """
+        Returns a new client, used like paho.mqtt.client.Client
+        """
+        return LocalClient(self)
+
+    def attach(self, client):
+        with self._lock:
+            self._clients.append(client)
+
+    def detach(self, client):
+        with self._lock:
+            if client in self._clients:
+                self._clients.remove(client)
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8')
+        message = LocalMessage(topic=topic, payload=payload, qos=qos, retain=retain)
+        with self._lock:
+            clients = list(self._clients)
+        for client in clients:
+            client.deliver(message)
+
+
+class LocalClient:
+    """
+    The part of the paho client interface used in here, connected to a LocalBroker
+    """
+    def __init__(self, broker):
+        self.broker = broker
+        self.subscriptions = set()
+        self.connected = False
+        self.on_connect = None
+        self.on_message = None
+
+    def connect(self, host=None, port=None, keepalive=None):
+        self.connected = True
+        self.broker.attach(self)
+        if self.on_connect is not None:
+            self.on_connect(self, None, {}, 0)
+        return 0
+
+    connect_async = connect
+
+    def disconnect(self):
+        self.connected = False
+        self.broker.detach(self)
+
+    def loop_start(self):
+        pass
+
+    def loop_stop(self, force=False):
+        pass
+
+    def subscribe(self, topic, qos=0):
+        self.subscriptions.add(topic)
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        self.broker.publish(topic, payload, qos, retain)
+
+    def deliver(self, message):
+        if self.on_message is None:
+            return
+        if any(topic_matches(subscription, message.topic) for subscription in self.subscriptions):
+            self.on_message(self, None, message)
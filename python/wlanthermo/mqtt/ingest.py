@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+import datetime
+import logging
+import queue
+import time
+from threading import Thread
+
+__author__ = 'Björn Schrader <wlanthermo@bjoern-schrader.de>'
+__license__ = 'GNU General Public License http://www.gnu.org/licenses/gpl.html'
+__copyright__ = 'Copyright (C) 2017 by WLANThermo Project - Released under terms of the GPLv3 License'
+
+# Readings waiting to be applied, further readings are dropped when full
+INGEST_QUEUE_SIZE = 10000
+# Seconds to wait for the remaining channels of a cycle sent channel by channel
+CYCLE_WAIT = 0.5
+
+
+class IngestWorker(Thread):
+    """
+    Collects the readings of module cycles and applies them to Channels in batches
+
+    A cycle is identified by module and timestamp. Cycles received in one
+    message are complete at once, cycles sent channel by channel are
+    complete after CYCLE_WAIT seconds or when the module starts a newer
+    cycle. All complete cycles of a module go to Channels.process_batch
+    together, so they are checked, applied and persisted as one batch.
+    """
+    _stop_marker = object()
+
+    def __init__(self, app, channels, queue_size=INGEST_QUEUE_SIZE, cycle_wait=CYCLE_WAIT):
+        super().__init__(name='MqttIngest', daemon=True)
+        self.logger = logging.getLogger(__name__)
+        self.app = app
+        self.channels = channels
+        self.cycle_wait = cycle_wait
+        self.queue = queue.Queue(maxsize=queue_size)
+        # Incomplete cycles by (module_id, timestamp)
+        self.pending = dict()
+
+        self.received = 0
+        self.dropped = 0
+        self.unknown = 0
+        self.batches = 0
+        self.cycles = 0
+
+    def put(self, module_id, timestamp, values, complete):
+        """
+        Queues the values {channel_id: value} of a cycle, called by the MQTT client thread
+        """
+        try:
+            self.queue.put_nowait((module_id, timestamp, values, complete))
+        except queue.Full:
+            self.dropped += 1
+            if self.dropped % 1000 == 1:
+                self.logger.warning('Ingest queue is full, {dropped} messages dropped so far'.format(
+                    dropped=self.dropped))
+        else:
+            self.received += 1
+
+    def run(self):
+        with self.app.app_context():
+            running = True
+            while running:
+                try:
+                    item = self.queue.get(timeout=self.next_timeout())
+                except queue.Empty:
+                    item = None
+                # Take everything queued by now, so bursts end up in one batch
+                while item is not None:
+                    if item is self._stop_marker:
+                        running = False
+                    else:
+                        self.add(*item)
+                    try:
+                        item = self.queue.get_nowait()
+                    except queue.Empty:
+                        item = None
+                try:
+                    self.flush(force=not running)
+                except Exception:
+                    # A bad cycle must not stop the ingest
+                    self.logger.exception('Flushing pending cycles failed')
+
+    def next_timeout(self):
+        if not self.pending:
+            return None
+        return max(0, min(cycle['deadline'] for cycle in self.pending.values()) - time.monotonic())
+
+    def add(self, module_id, timestamp, values, complete):
+        try:
+            cycle = self.pending[(module_id, timestamp)]
+        except KeyError:
+            cycle = self.pending[(module_id, timestamp)] = {
+                'values': dict(),
+                'deadline': time.monotonic() + self.cycle_wait,
+            }
+        cycle['values'].update(values)
+        if complete:
+            cycle['deadline'] = 0
+
+    def flush(self, force=False):
+        """
+        Applies all complete cycles, all pending ones if force is set
+        """
+        now = time.monotonic()
+        latest = dict()
+        for module_id, timestamp in self.pending:
+            latest[module_id] = max(timestamp, latest.get(module_id, timestamp))
+
+        ready = dict()
+        for (module_id, timestamp), cycle in list(self.pending.items()):
+            if force or cycle['deadline'] <= now or timestamp < latest[module_id]:
+                ready.setdefault(module_id, []).append((timestamp, cycle['values']))
+                del self.pending[(module_id, timestamp)]
+
+        for module_id, cycles in ready.items():
+            self.apply(module_id, sorted(cycles, key=lambda cycle: cycle[0]))
+
+    def apply(self, module_id, cycles):
+        batch = []
+        for timestamp, values in cycles:
+            known = dict()
+            for channel_id, value in values.items():
+                if self.channels.is_registered(module_id, channel_id):
+                    known[channel_id] = value
+                else:
+                    self.unknown += 1
+            if not known:
+                continue
+            try:
+                batch.append((datetime.datetime.utcfromtimestamp(timestamp), known))
+            except (OverflowError, OSError, ValueError):
+                self.logger.warning('Timestamp {timestamp} of module {module_id} is out of range'.format(
+                    timestamp=timestamp,
+                    module_id=module_id))
+        if not batch:
+            return
+        try:
+            self.channels.process_batch(module_id, batch)
+        except Exception:
+            self.logger.exception('Applying {count} cycles of module {module_id} failed'.format(
+                count=len(batch),
+                module_id=module_id))
+        else:
+            self.batches += 1
+            self.cycles += len(batch)
+
+    def stop(self):
+        if self.is_alive():
+            self.queue.put(self._stop_marker)
+            self.join()
+
+    def statistics(self):
+        return {
+            'received': self.received,
+            'dropped': self.dropped,
+            'unknown_channels': self.unknown,
+            'pending_cycles': len(self.pending),
+            'batches': self.batches,
+            'cycles': self.cycles,
+        }
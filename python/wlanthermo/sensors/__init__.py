@@ -5,14 +5,24 @@ import logging
 import os
 import yaml
 import json
+from collections import namedtuple
 from cerberus import Validator
 from cerberus.schema import SchemaError
 from .sensor_types import *
+from .watcher import *
 
 __author__ = 'Björn Schrader <wlanthermo@bjoern-schrader.de>'
 __license__ = 'GNU General Public License http://www.gnu.org/licenses/gpl.html'
 __copyright__ = 'Copyright (C) 2017 by WLANThermo Project - Released under terms of the GPLv3 License'
 
+# Increase when the validation of sensor files changes, to discard old caches
+SENSOR_CACHE_VERSION = 1
+
+
+# Everything derived from one scan of the sensors directory, replaced as a whole on rescan
+SensorCatalogue = namedtuple('SensorCatalogue', ('sensors', 'by_type', 'by_module', 'files'))
+
+
 class NoSensorFoundException(Exception):
     pass
 
@@ -26,45 +36,113 @@ class Sensors():
             self.logger.fatal('Sensors config path could not be found ({sensors_dir})'.format(
                 sensors_dir=self.sensors_dir))
             raise FileNotFoundError
-        self.sensors = dict()
+        self.cache_path = os.path.join(self.wlanthermo.app.config['WLANTHERMO_CONFIG_DIR'], '.sensors_cache.json')
+        self._catalogue = SensorCatalogue(sensors=dict(), by_type=dict(), by_module=dict(), files=None)
         self.scan_sensors()
+        self.watcher = SensorWatcher(self.sensors_dir, self.rescan)
 
-    def scan_sensors(self):
-        sensors = dict()
+    @property
+    def sensors(self):
+        return self._catalogue.sensors
+
+    def start(self):
+        self.watcher.start()
+
+    def stop(self):
+        self.watcher.stop()
+
+    def rescan(self):
+        """
+        Called by the watcher on changes, keeps the current sensors if the new ones are unusable
+        """
+        self.logger.info('Sensor files changed, rescanning {sensors_dir}'.format(sensors_dir=self.sensors_dir))
+        try:
+            self.scan_sensors()
+        except NoSensorFoundException:
+            self.logger.error('Keeping previous sensor definitions')
+
+    def load_sensor_file(self, entry_name, entry_path):
+        """
+        Parses and validates a sensor file, returns the sensor or None if it is invalid
+        """
+        self.logger.debug('Loading sensor file "{entry_name}" from "{entry_path}"'.format(
+            entry_name=entry_name,
+            entry_path=entry_path))
+        with open(entry_path, 'r') as sensor_file:
+            sensor = yaml.load(sensor_file)
+        # Check basic parameters
         v_sensor = Validator('sensor')
         v_sensor.allow_unknown = True
-        for entry_name in sorted(os.listdir(self.sensors_dir)):
-            entry_path = os.path.join(self.sensors_dir, entry_name)
-            if os.path.isfile(entry_path) and entry_name.endswith('.yaml'):
-                self.logger.debug('Loading sensor file "{entry_name}" from "{entry_path}"'.format(
+        if not v_sensor.validate(sensor):
+            self.logger.warning(
+                '"{entry_name}" is not a sensor file, please check format, message: {message}'.format(
                     entry_name=entry_name,
-                    entry_path=entry_path))
-                with open(entry_path, 'r') as sensor_file:
-                    sensor = yaml.load(sensor_file)
-                # Check basic parameters
-                if not v_sensor.validate(sensor):
-                    self.logger.warning(
-                        '"{entry_name}" is not a sensor file, please check format, message: {message}'.format(
-                            entry_name=entry_name,
-                            message=v_sensor.errors))
-                    continue
-                try:
-                    # Check format matching sensor file
-                    sensor_type = sensor['type']
-                    type_validator = Validator('sensor_' + sensor_type)
-                    type_validator.allow_unknown = True
-                    if not type_validator.validate(sensor):
-                        self.logger.warning(
-                            'Invalid sensor file "{entry_name}" - check parameters! Message: {message}'.format(
-                            entry_name=entry_name,
-                            message=v_sensor.errors,
-                            )
-                        )
-                        continue
-                except SchemaError:
-                    # Schema not found
-                    self.logger.error('Can´t verify sensor file "{entry_name}" - no matching schema found, skipping!'.format(
-                            entry_name=entry_name))
+                    message=v_sensor.errors))
+            return None
+        try:
+            # Check format matching sensor file
+            sensor_type = sensor['type']
+            type_validator = Validator('sensor_' + sensor_type)
+            type_validator.allow_unknown = True
+            if not type_validator.validate(sensor):
+                self.logger.warning(
+                    'Invalid sensor file "{entry_name}" - check parameters! Message: {message}'.format(
+                    entry_name=entry_name,
+                    message=v_sensor.errors,
+                    )
+                )
+                return None
+        except SchemaError:
+            # Schema not found
+            self.logger.error('Can´t verify sensor file "{entry_name}" - no matching schema found, skipping!'.format(
+                    entry_name=entry_name))
+            return None
+        return sensor
+
+    def load_cache(self):
+        """
+        Returns {entry_name: {'mtime': ..., 'size': ..., 'sensor': sensor or None}} from the catalogue cache
+        """
+        try:
+            with open(self.cache_path, 'r') as cache_file:
+                cache = json.load(cache_file)
+        except (OSError, ValueError):
+            return dict()
+        if not isinstance(cache, dict) or cache.get('version') != SENSOR_CACHE_VERSION:
+            return dict()
+        return cache['files']
+
+    def save_cache(self, files):
+        temp_path = self.cache_path + '.tmp'
+        try:
+            with open(temp_path, 'w') as cache_file:
+                json.dump({'version': SENSOR_CACHE_VERSION, 'files': files}, cache_file)
+            os.replace(temp_path, self.cache_path)
+        except OSError as error:
+            self.logger.warning('Sensor cache could not be written: {error}'.format(error=error))
+
+    def scan_sensors(self):
+        """
+        Reads all sensor files, files unchanged since the last scan (same name,
+        mtime and size) are taken from the catalogue cache without parsing
+        """
+        sensors = dict()
+        cache = self._catalogue.files
+        if cache is None:
+            cache = self.load_cache()
+        files = dict()
+        for entry in sorted(os.scandir(self.sensors_dir), key=lambda entry: entry.name):
+            entry_name = entry.name
+            entry_path = entry.path
+            if entry.is_file() and entry_name.endswith('.yaml'):
+                stat = entry.stat()
+                cached = cache.get(entry_name)
+                if cached is not None and cached['mtime'] == stat.st_mtime_ns and cached['size'] == stat.st_size:
+                    sensor = cached['sensor']
+                else:
+                    sensor = self.load_sensor_file(entry_name, entry_path)
+                files[entry_name] = {'mtime': stat.st_mtime_ns, 'size': stat.st_size, 'sensor': sensor}
+                if sensor is None:
                     continue
                 sensors[sensor['name']] = sensor
                 self.logger.info('Added sensor "{sensor_name}" of type "{sensor_type}" to list'.format(
@@ -73,18 +151,51 @@ class Sensors():
             else:
                 continue
 
+        if files != cache:
+            self.save_cache(files)
+
         if not sensors:
             self.logger.fatal('No valid sensor definition found')
             raise NoSensorFoundException('No valid sensor definition found in {sensors_dir}'.format(sensors_dir=self.sensors_dir))
 
-        self.sensors = sensors
+        by_type = dict()
+        for sensor_name, sensor in sensors.items():
+            by_type.setdefault(sensor['type'], dict())[sensor_name] = sensor
+
+        # Replaced in one assignment, readers see either the old or the new catalogue
+        self._catalogue = SensorCatalogue(sensors=sensors, by_type=by_type, by_module=dict(), files=files)
 
     def by_type(self, type):
-        retval = {sensor_name: sensor for (sensor_name, sensor) in self.sensors.items() if sensor['type'] == type}
-        return retval
+        """
+        Returns {sensor_name: sensor} of all sensors of the given type, not to be modified
+        """
+        return self._catalogue.by_type.get(type, {})
+
+    def by_module(self, module_id, sensor_types):
+        """
+        Returns the names of all sensors usable by a module supporting sensor_types
+        The list is cached per module until the sensors are rescanned or sensor_types change
+        """
+        catalogue = self._catalogue
+        sensor_types = tuple(sensor_types)
+        try:
+            cached_types, sensor_names = catalogue.by_module[module_id]
+            if cached_types == sensor_types:
+                return sensor_names
+        except KeyError:
+            pass
+        sensor_names = []
+        for sensor_type in sensor_types:
+            sensor_names.extend(catalogue.by_type.get(sensor_type, {}).keys())
+        catalogue.by_module[module_id] = (sensor_types, sensor_names)
+        return sensor_names
+
+    def invalidate_module(self, module_id):
+        self._catalogue.by_module.pop(module_id, None)
 
     def types(self, types=None):
+        sensors = self._catalogue.sensors
         if types is None:
-            return self.sensors.keys()
+            return sensors.keys()
         else:
-            return [key for key in self.sensors.keys() if key in types]
+            return [key for key in sensors.keys() if key in types]
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+import logging
+import os
+import threading
+from threading import Thread
+
+try:
+    import inotify_simple
+except ImportError:
+    inotify_simple = None
+
+__author__ = 'Björn Schrader <wlanthermo@bjoern-schrader.de>'
+__license__ = 'GNU General Public License http://www.gnu.org/licenses/gpl.html'
+__copyright__ = 'Copyright (C) 2017 by WLANThermo Project - Released under terms of the GPLv3 License'
+
+# Seconds between two checks of the directory if inotify is not available
+POLL_INTERVAL = 5.0
+# Seconds to wait for further changes before rescanning, editors write files in several steps
+SETTLE_TIME = 0.5
+
+
+def directory_state(path):
+    """
+    Returns {file name: (mtime, size)} of all yaml files in path
+    """
+    state = dict()
+    for entry in os.scandir(path):
+        if entry.is_file() and entry.name.endswith('.yaml'):
+            stat = entry.stat()
+            state[entry.name] = (stat.st_mtime_ns, stat.st_size)
+    return state
+
+
+class SensorWatcher(Thread):
+    """
+    Calls on_change when sensor files in path are added, changed or removed
+
+    Uses inotify if inotify_simple is installed, otherwise the mtimes of
+    the files are polled every POLL_INTERVAL seconds.
+    """
+    def __init__(self, path, on_change, poll_interval=POLL_INTERVAL):
+        super().__init__(name='SensorWatcher', daemon=True)
+        self.logger = logging.getLogger(__name__)
+        self.path = path
+        self.on_change = on_change
+        self.poll_interval = poll_interval
+        self._stop_event = threading.Event()
+
+    def run(self):
+        if inotify_simple is not None:
+            self.logger.info('Watching {path} with inotify'.format(path=self.path))
+            self.run_inotify()
+        else:
+            self.logger.info('Watching {path} every {interval} s'.format(path=self.path, interval=self.poll_interval))
+            self.run_polling()
+
+    def run_inotify(self):
+        flags = inotify_simple.flags
+        with inotify_simple.INotify() as inotify:
+            inotify.add_watch(self.path, flags.CLOSE_WRITE | flags.CREATE | flags.DELETE |
+                              flags.MOVED_TO | flags.MOVED_FROM)
+            while not self._stop_event.is_set():
+                events = inotify.read(timeout=int(self.poll_interval * 1000))
+                if not any(event.name.endswith('.yaml') for event in events):
+                    continue
+                # Collect the rest of a multi step write
+                while inotify.read(timeout=int(SETTLE_TIME * 1000)):
+                    pass
+                self.changed()
+
+    def run_polling(self):
+        state = directory_state(self.path)
+        while not self._stop_event.wait(self.poll_interval):
+            new_state = directory_state(self.path)
+            if new_state != state:
+                self._stop_event.wait(SETTLE_TIME)
+                state = directory_state(self.path)
+                self.changed()
+
+    def changed(self):
+        try:
+            self.on_change()
+        except Exception:
+            self.logger.exception('Reloading sensor files failed')
+
+    def stop(self):
+        self._stop_event.set()
+        if self.is_alive():
+            self.join()
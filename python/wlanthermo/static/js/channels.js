@@ -1,11 +1,18 @@
 	var channels_api = "api/channels"; // API der Kanäle
+	var channels_stream_api = "api/channels/stream"; // Server-Sent Events der Kanäle
 	var colors_api = "api/colors"; // API der verfügbaren Farben
 	var refreshInterval = "2000"; // Refresh Intervall in ms der Temp Werte
 	var getTimeout = "3000"; // Timeout der get API's
 	
+	var channelData = {}; // Letzter bekannter Stand aller Kanäle
+	
 	$(document).ready(function(){
-		readTemp();
-		setInterval("readTemp();", refreshInterval);	
+		if (!!window.EventSource) {
+			streamTemp();
+		} else {
+			readTemp();
+			setInterval("readTemp();", refreshInterval);
+		}
 	});
 
 	function addChannel(){
@@ -20,11 +27,37 @@
 		$(".channel_index").children().last().remove();
 	}
 	
+	function streamTemp(){
+		// Der Server schickt beim Verbinden einen Snapshot, danach nur geänderte Kanäle
+		var source = new EventSource(channels_stream_api);
+		source.addEventListener('snapshot', function (event) {
+			channelData = JSON.parse(event.data);
+			showTemp(channelData);
+		});
+		source.addEventListener('update', function (event) {
+			var update = JSON.parse(event.data);
+			for(var channels in update){
+				if (!(channels in channelData)){
+					channelData[channels] = {};
+				}
+				for(var channel in update[channels]){
+					channelData[channels][channel] = update[channels][channel];
+				}
+			}
+			showTemp(channelData);
+		});
+	}
+	
 	function readTemp(){
+		$.getJSON(channels_api, function (response) {
+			showTemp(response);
+		})
+	}
+	
+	function showTemp(response){
 		if (updateActivated == 'true'){
 				checkUpdateActivated();
 		} else {
-			$.getJSON(channels_api, function (response) {
 				var channel_length = 0;
 				for(var channels in response){
 					for(var channel in response[channels]){
@@ -67,7 +100,6 @@
 						channel_index++;
 					}
 				}
-			})
 		}
 	}
 